@@ -1,65 +1,121 @@
 import time
 import pandas as pd
 import numpy as np
+from streaming_features import RollingMean
+
+# Decision thresholds
+SPREAD_THRESHOLD = 0.0005
+VOLUME_IMBALANCE_THRESHOLD = 0
+MOMENTUM_THRESHOLD = 0.02
+
+# Number of previous bars averaged into the momentum
+MOMENTUM_WINDOW = 3
+
+REQUIRED_COLUMNS = {'askPriceAvg', 'bidPriceAvg', 'bidVolumeSum', 'askVolumeSum', 'actualPriceAvg'}
 
 def get_spread(data):
     return data['askPriceAvg'] - data['bidPriceAvg']
 
-def get_volume_impalance(data):
-    total_volume = data['bidVolumeSum'] + data['askVolumeSum']
-    #print(str(data['bidVolumeSum'] - data['askVolumeSum']) + " / " + str(total_volume) + " = " + str((data['bidVolumeSum'] - data['askVolumeSum']) / total_volume))
-    if total_volume == 0:
-        return 0
-    return (data['bidVolumeSum'] - data['askVolumeSum']) / total_volume
+def get_volume_imbalance(data):
+    bid_volume = np.asarray(data['bidVolumeSum'], dtype=float)
+    ask_volume = np.asarray(data['askVolumeSum'], dtype=float)
+    total_volume = bid_volume + ask_volume
+    with np.errstate(divide='ignore', invalid='ignore'):
+        imbalance = (bid_volume - ask_volume) / total_volume
+    return np.where(total_volume == 0, 0.0, imbalance)
 
 def get_momentum(data):
-    return data['actualPriceAvg'].rolling(window=3).mean()
-
-def predict_stock(latest, historical):
-    required_columns = {'askPriceAvg', 'bidPriceAvg', 'bidVolumeSum', 'askVolumeSum', 'actualPriceAvg'}
-    if not required_columns.issubset(historical.columns):
-        raise ValueError(f"Missing required columns: {required_columns - set(historical.columns)}")
-
-    historical = historical.copy()
-    historical['spread'] = historical.apply(get_spread, axis=1)
-    historical['volume_imbalance'] = historical.apply(get_volume_impalance, axis=1)
-    historical['momentum'] = get_momentum(historical)
-
-    # Get metrics for the latest record
-    spread = get_spread(latest)
-    volume_imbalance = get_volume_impalance(latest)
-    momentum = historical['momentum'].iloc[-1]
-
-    # Define thresholds
-    spread_threshold = 0.0005
-    volume_imbalance_threshold = 0
-    momentum_threshold = 0.02
-
-    # Decision logic
-    if (
-        spread > spread_threshold
-        and volume_imbalance > volume_imbalance_threshold
-    ):
-        return f"BUY | {spread} | {momentum} | {volume_imbalance}"
-    elif (
-        spread < -spread_threshold
-        and volume_imbalance < -volume_imbalance_threshold
-    ):
-        return f"SELL | {spread} | {momentum} | {volume_imbalance}"
-    else:
-        return f"HOLD | {spread} | {momentum} | {volume_imbalance}"
+    return data['actualPriceAvg'].rolling(window=MOMENTUM_WINDOW).mean()
+
+def decide(spread, volume_imbalance, spread_threshold=SPREAD_THRESHOLD, volume_imbalance_threshold=VOLUME_IMBALANCE_THRESHOLD):
+    """
+    BUY/SELL/HOLD for arrays (or scalars) of spread and volume imbalance.
+    """
+    spread = np.asarray(spread, dtype=float)
+    volume_imbalance = np.asarray(volume_imbalance, dtype=float)
+    return np.select(
+        [
+            (spread > spread_threshold) & (volume_imbalance > volume_imbalance_threshold),
+            (spread < -spread_threshold) & (volume_imbalance < -volume_imbalance_threshold),
+        ],
+        ["BUY", "SELL"],
+        default="HOLD",
+    )
+
+def check_columns(data):
+    columns = data.columns if isinstance(data, pd.DataFrame) else data.keys()
+    if not REQUIRED_COLUMNS.issubset(columns):
+        raise ValueError(f"Missing required columns: {REQUIRED_COLUMNS - set(columns)}")
+
+def predict_stock(data, spread_threshold=SPREAD_THRESHOLD, volume_imbalance_threshold=VOLUME_IMBALANCE_THRESHOLD):
+    """
+    Compute the decision for every bar of a series in one vectorized pass.
+    Each bar is compared with the bars before it, so the first bar has no decision.
+    Returns a DataFrame with the timestamp, decision, spread, momentum and volume imbalance.
+    """
+    check_columns(data)
+
+    spread = get_spread(data).to_numpy(dtype=float)
+    volume_imbalance = get_volume_imbalance(data)
+    momentum = get_momentum(data).shift(1).to_numpy(dtype=float)  # Momentum of the previous bars only
 
-file = "./streamed_data.json"
-data_json = pd.read_json(file)
+    decisions = pd.DataFrame({
+        'timestamp': data['timestamp'].to_numpy() if 'timestamp' in data else data.index.to_numpy(),
+        'decision': decide(spread, volume_imbalance, spread_threshold, volume_imbalance_threshold),
+        'spread': spread,
+        'momentum': momentum,
+        'volume_imbalance': volume_imbalance,
+    }, index=data.index)
+    return decisions.iloc[1:]
+
+class SignalEngine:
+    """
+    Incremental version of predict_stock for live bars: update(latest) keeps the rolling
+    momentum state and returns the same decision predict_stock gives for that bar.
+    """
+
+    def __init__(self, spread_threshold=SPREAD_THRESHOLD, volume_imbalance_threshold=VOLUME_IMBALANCE_THRESHOLD):
+        self.spread_threshold = spread_threshold
+        self.volume_imbalance_threshold = volume_imbalance_threshold
+        self.momentum = RollingMean(MOMENTUM_WINDOW, min_periods=MOMENTUM_WINDOW)
+        self.seen_first = False
+
+    def update(self, latest):
+        """
+        Decide on the latest bar given every bar passed before it.
+        Returns None for the first bar, which has no history to compare with.
+        """
+        check_columns(latest)
+
+        decision = None
+        if self.seen_first:
+            spread = float(get_spread(latest))
+            volume_imbalance = float(get_volume_imbalance(latest))
+            decision = {
+                'timestamp': latest.get('timestamp'),
+                'decision': str(decide(spread, volume_imbalance, self.spread_threshold, self.volume_imbalance_threshold)),
+                'spread': spread,
+                'momentum': self.momentum.mean(),
+                'volume_imbalance': volume_imbalance,
+            }
+
+        self.momentum.push(float(latest['actualPriceAvg']))
+        self.seen_first = True
+        return decision
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1:
+        # Build the bars from a market directory instead of reading the saved file
+        import bar_aggregator
+        data_json = bar_aggregator.bars_frame(bar_aggregator.market_bars(sys.argv[1]))
+    else:
+        file = "./streamed_data.json"
+        data_json = pd.read_json(file)
 
-for i in range(1, len(data_json)):  # Start from the second record to compare with previous data
-    latest = data_json.iloc[i]  # Current record
-    historical = data_json.iloc[:i]  # All previous records
-    
     try:
-        decision = predict_stock(latest, historical)
-        print(f"Timestamp: {latest['timestamp']} | Decision: {decision}")
+        decisions = predict_stock(data_json)
+        for row in decisions.itertuples():
+            print(f"Timestamp: {row.timestamp} | Decision: {row.decision} | {row.spread} | {row.momentum} | {row.volume_imbalance}")
     except ValueError as e:
-        print(f"Skipping data at index {i} due to missing fields: {e}")
-    except Exception as e:
-        print(f"An error occurred at index {i}: {e}")
+        print(f"Skipping data due to missing fields: {e}")
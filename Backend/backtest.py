@@ -0,0 +1,214 @@
+import os
+import itertools
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+import analysis
+import bar_aggregator
+import data_processing
+import features
+from forest_engine import CompiledForest
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+COMPILED_MODEL_DIR = os.path.join(BASE_DIR, 'ModelOutput/compiled_forest')
+
+STRATEGIES = ('signals', 'model')
+
+# Cost per unit traded, on top of crossing the spread
+DEFAULT_FEE = 0.0
+
+# Threshold combinations evaluated together in one array operation
+GRID_CHUNK_SIZE = 64
+
+def target_positions(signals):
+    """
+    Position held after each event for signals of +1 (buy), -1 (sell) and 0 (hold, keep the
+    current position). Works along the last axis, so a whole grid of signal rows at once.
+    """
+    n = signals.shape[-1]
+    last_signal = np.maximum.accumulate(np.where(signals != 0, np.arange(n), 0), axis=-1)
+    return np.take_along_axis(signals, last_signal, axis=-1)
+
+def simulate(positions, bid, ask, fee=DEFAULT_FEE):
+    """
+    Trade straight to each target position of -1, 0 or +1 units, filling at the quote of the
+    next event: buys at the ask, sells at the bid, so a flip from long to short sells two units
+    at once and pays the fee on both. Open positions are marked to the mid price.
+    positions may hold one row per parameter combination. Returns a dict of arrays with one
+    value per row: pnl, trades (the events with a fill, whatever its size), max_drawdown and
+    exposure.
+    """
+    positions = np.atleast_2d(positions)
+    mid = (bid + ask) / 2
+
+    # The decision made at event i is filled at event i + 1
+    held = np.zeros(positions.shape, dtype=np.float64)
+    held[:, 1:] = positions[:, :-1]
+    traded = np.diff(held, axis=1, prepend=0.0)
+
+    fill_price = np.where(traded > 0, ask, bid)
+    cash = -np.cumsum(np.where(traded != 0, traded * fill_price + np.abs(traded) * fee, 0.0), axis=1)
+    equity = cash + np.where(held != 0, held * mid, 0.0)
+
+    return {
+        'pnl': equity[:, -1] if equity.shape[1] else np.zeros(len(positions)),
+        'trades': np.count_nonzero(traded, axis=1),
+        'max_drawdown': (np.maximum.accumulate(equity, axis=1) - equity).max(axis=1, initial=0.0),
+        'exposure': np.count_nonzero(held, axis=1) / max(held.shape[1], 1),
+    }
+
+def decision_signals(decisions):
+    """
+    +1/-1/0 for BUY/SELL/HOLD decisions (either capitalization).
+    """
+    decisions = np.char.upper(np.asarray(decisions, dtype=str))
+    return (decisions == 'BUY').astype(np.int8) - (decisions == 'SELL').astype(np.int8)
+
+def tradable(bid, ask):
+    """
+    Events with a two-sided quote; no trade is decided before the first one. Bars before the
+    first quote have prices of 0 and rows before it NaN, both are excluded.
+    """
+    return (bid > 0) & (ask > 0)
+
+def signals_inputs(market_folder):
+    """
+    Bars of a market and the arrays the signal strategy is evaluated on.
+    """
+    bars = bar_aggregator.bars_frame(bar_aggregator.market_bars(market_folder))
+    return {
+        'bid': bars['bidPriceAvg'].to_numpy(dtype=float),
+        'ask': bars['askPriceAvg'].to_numpy(dtype=float),
+        'spread': analysis.get_spread(bars).to_numpy(dtype=float),
+        'volume_imbalance': analysis.get_volume_imbalance(bars),
+        'bars': bars,
+    }
+
+def signal_grid(inputs, spread_thresholds, volume_imbalance_thresholds):
+    """
+    Signals of every threshold combination in one broadcast call to analysis.decide; row k
+    belongs to the k-th combination. The first bar has no decision, as in predict_stock.
+    """
+    decisions = analysis.decide(inputs['spread'][np.newaxis, :], inputs['volume_imbalance'][np.newaxis, :],
+                                np.asarray(spread_thresholds, dtype=float)[:, np.newaxis],
+                                np.asarray(volume_imbalance_thresholds, dtype=float)[:, np.newaxis])
+    signals = decision_signals(decisions)
+    signals[:, :1] = 0
+    signals[:, ~tradable(inputs['bid'], inputs['ask'])] = 0
+    return signals
+
+def run_signals(market_folder, fee=DEFAULT_FEE, grid=None):
+    inputs = signals_inputs(market_folder)
+    if not len(inputs['bars']):
+        return None, None
+
+    # The strategy as analysis.predict_stock runs it
+    decisions = analysis.predict_stock(inputs['bars'])['decision']
+    signals = np.zeros(len(inputs['bars']), dtype=np.int8)
+    signals[1:] = decision_signals(decisions)
+    signals[~tradable(inputs['bid'], inputs['ask'])] = 0
+    stats = {name: values[0] for name, values in simulate(target_positions(signals), inputs['bid'], inputs['ask'], fee).items()}
+    stats['events'] = len(signals)
+
+    if grid is None:
+        return stats, None
+
+    # Every combination on the same arrays, a chunk of combinations per call
+    results = {name: [] for name in ('pnl', 'trades', 'max_drawdown', 'exposure')}
+    for start in range(0, len(grid), GRID_CHUNK_SIZE):
+        chunk = grid[start:start + GRID_CHUNK_SIZE]
+        positions = target_positions(signal_grid(inputs, [combo[0] for combo in chunk], [combo[1] for combo in chunk]))
+        for name, values in simulate(positions, inputs['bid'], inputs['ask'], fee).items():
+            results[name].append(values)
+    return stats, {name: np.concatenate(values) for name, values in results.items()}
+
+def run_model(market_folder, fee=DEFAULT_FEE, model_dir=COMPILED_MODEL_DIR):
+    merged_df = data_processing.load_market(market_folder, float_dtype="float64")  # As served
+    if merged_df is None or merged_df.empty:
+        return None
+
+    features_df = features.add_features(merged_df)
+    actions = CompiledForest(model_dir).predict(features_df[features.FEATURE_COLUMNS])
+
+    bid = features_df['bidPrice'].to_numpy(dtype=float)
+    ask = features_df['askPrice'].to_numpy(dtype=float)
+    signals = decision_signals(actions)
+    signals[~tradable(bid, ask)] = 0
+    stats = {name: values[0] for name, values in simulate(target_positions(signals), bid, ask, fee).items()}
+    stats['events'] = len(signals)
+    return stats
+
+def _backtest_market(task):
+    period, market, market_folder, strategy, fee, grid = task
+    if strategy == 'signals':
+        stats, grid_results = run_signals(market_folder, fee, grid)
+    else:
+        stats, grid_results = run_model(market_folder, fee), None
+    if stats is not None:
+        stats = {'period': period, 'market': market, 'strategy': strategy, **stats}
+    return stats, grid_results
+
+def run_backtest(base_data_folder="TrainingData", strategy='signals', fee=DEFAULT_FEE, spread_thresholds=None,
+                 volume_imbalance_thresholds=None, max_workers=None):
+    """
+    Backtest a strategy over every (period, market) in parallel worker processes.
+    Returns the per-market statistics and, when threshold lists are given for the signal
+    strategy, the results of every threshold combination summed over all markets.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy {strategy}, expected one of {STRATEGIES}")
+
+    grid = None
+    if strategy == 'signals' and (spread_thresholds is not None or volume_imbalance_thresholds is not None):
+        grid = list(itertools.product(spread_thresholds or [analysis.SPREAD_THRESHOLD],
+                                      volume_imbalance_thresholds or [analysis.VOLUME_IMBALANCE_THRESHOLD]))
+
+    tasks = [(period, market, folder, strategy, fee, grid) for period, market, folder in data_processing.market_folders(base_data_folder)]
+    market_stats = []
+    grid_totals = None
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for stats, grid_results in executor.map(_backtest_market, tasks):
+            if stats is None:
+                continue
+            market_stats.append(stats)
+            if grid_results is not None:
+                if grid_totals is None:
+                    grid_totals = {'pnl': 0.0, 'trades': 0, 'max_drawdown': 0.0}
+                grid_totals['pnl'] = grid_totals['pnl'] + grid_results['pnl']
+                grid_totals['trades'] = grid_totals['trades'] + grid_results['trades']
+                grid_totals['max_drawdown'] = np.maximum(grid_totals['max_drawdown'], grid_results['max_drawdown'])
+
+    grid_df = None
+    if grid is not None and grid_totals is not None:
+        grid_df = pd.DataFrame(grid, columns=['spread_threshold', 'volume_imbalance_threshold'])
+        grid_df['pnl'] = grid_totals['pnl']
+        grid_df['trades'] = grid_totals['trades']
+        grid_df['max_drawdown'] = grid_totals['max_drawdown']  # Worst single market
+        grid_df = grid_df.sort_values('pnl', ascending=False, ignore_index=True)
+
+    return pd.DataFrame(market_stats), grid_df
+
+def parse_values(value):
+    return [float(item) for item in value.split(',')] if value else None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backtest the trading signals or the model over TrainingData.")
+    parser.add_argument('--data', default="TrainingData")
+    parser.add_argument('--strategy', choices=STRATEGIES, default='signals')
+    parser.add_argument('--fee', type=float, default=DEFAULT_FEE, help="Cost per unit traded")
+    parser.add_argument('--spread', help="Comma separated spread thresholds to search")
+    parser.add_argument('--imbalance', help="Comma separated volume imbalance thresholds to search")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', help="CSV file for the per-market statistics")
+    args = parser.parse_args()
+
+    market_stats, grid_df = run_backtest(args.data, args.strategy, args.fee, parse_values(args.spread), parse_values(args.imbalance), args.workers)
+    print(market_stats.to_string(index=False))
+    print(f"Total PnL: {market_stats['pnl'].sum() if not market_stats.empty else 0.0}")
+    if grid_df is not None:
+        print("\nThreshold search, best first:")
+        print(grid_df.head(20).to_string(index=False))
+    if args.output:
+        market_stats.to_csv(args.output, index=False)
+        print(f"Statistics saved to {args.output}")
@@ -0,0 +1,203 @@
+import heapq
+import json
+import pandas as pd
+import chunked_ingest
+from streaming_features import CompensatedSum
+
+# Fields of a bar, as in streamed_data.json
+BAR_FIELDS = [
+    'actualPriceAvg', 'actualPriceSum', 'actualVolumeAvg', 'actualVolumeSum',
+    'askPriceAvg', 'askPriceSum', 'askVolumeAvg', 'askVolumeSum',
+    'bidPriceAvg', 'bidPriceSum', 'bidVolumeAvg', 'bidVolumeSum',
+    'timestamp',
+]
+BAR_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Bar lengths in seconds built when none are given
+DEFAULT_INTERVALS = (1,)
+
+NANOS_PER_SECOND = 1_000_000_000
+
+class Bar:
+    """
+    Accumulated quotes and trades of one interval.
+    """
+
+    def __init__(self, start):
+        self.start = start  # Epoch nanoseconds
+        self.quotes = 0
+        self.trades = 0
+        self.sums = {field: CompensatedSum() for field in ('askPrice', 'askVolume', 'bidPrice', 'bidVolume', 'actualPrice', 'actualVolume')}
+
+    def add_quote(self, quote):
+        self.quotes += 1
+        for field in ('askPrice', 'askVolume', 'bidPrice', 'bidVolume'):
+            self.sums[field].add(quote[field])
+
+    def add_trade(self, trade):
+        self.trades += 1
+        self.sums['actualPrice'].add(trade['price'])
+        self.sums['actualVolume'].add(trade['volume'])
+
+    def to_record(self, previous=None):
+        """
+        The bar in the streamed_data.json schema. Without trades the actual fields are 0, and
+        without quotes the quoted prices carry over from the previous bar with zero sums.
+        """
+        record = {}
+        for field, total in self.sums.items():
+            if total.count:
+                record[f'{field}Avg'] = total.mean()
+                record[f'{field}Sum'] = total.sum
+            else:
+                carried = previous is not None and field in ('askPrice', 'bidPrice')
+                record[f'{field}Avg'] = previous[f'{field}Avg'] if carried else 0.0
+                record[f'{field}Sum'] = 0.0
+        record['timestamp'] = pd.Timestamp(self.start)
+        return {field: record[field] for field in BAR_FIELDS}
+
+class BarAggregator:
+    """
+    Folds a time-ordered stream of quotes and trades into bars of several intervals at once,
+    in a single pass. A bar is emitted once its interval has closed, that is once a tick at
+    least allowed_lateness seconds past its end has been seen. Ticks older than that are late:
+    they are counted in late_ticks and dropped. With fill_empty, intervals without any tick
+    still produce a bar, so every series has one bar per interval.
+    """
+
+    def __init__(self, intervals=DEFAULT_INTERVALS, allowed_lateness=0.0, fill_empty=True):
+        self.intervals = tuple(int(interval) for interval in intervals)
+        self.allowed_lateness = int(allowed_lateness * NANOS_PER_SECOND)
+        self.fill_empty = fill_empty
+        self.late_ticks = 0
+
+        self.watermark = None  # Latest tick time seen
+        self._open = {interval: {} for interval in self.intervals}  # interval -> {start: Bar}
+        self._next_start = dict.fromkeys(self.intervals)  # First interval start not emitted yet
+        self._previous = dict.fromkeys(self.intervals)  # Last record emitted per interval
+
+    def update_quote(self, quote):
+        """
+        Add a quote; returns the (interval, bar) pairs closed by it, which may be empty.
+        """
+        return self._update(quote, Bar.add_quote)
+
+    def update_trade(self, trade):
+        """
+        Add a trade; returns the (interval, bar) pairs closed by it, which may be empty.
+        """
+        return self._update(trade, Bar.add_trade)
+
+    def _update(self, tick, add):
+        timestamp = pd.Timestamp(tick['timestamp']).value
+        late = False
+        for interval in self.intervals:
+            length = interval * NANOS_PER_SECOND
+            start = timestamp - timestamp % length
+            if self._next_start[interval] is None:
+                self._next_start[interval] = start
+            if start < self._next_start[interval]:
+                late = True  # Its bar was already emitted
+                continue
+
+            bars = self._open[interval]
+            bar = bars.get(start)
+            if bar is None:
+                bar = bars[start] = Bar(start)
+            add(bar, tick)
+
+        self.late_ticks += late
+        if self.watermark is None or timestamp > self.watermark:
+            self.watermark = timestamp
+        return self._emit(self.watermark - self.allowed_lateness)
+
+    def _emit(self, until, intervals=None):
+        """
+        Emit the bars that end at or before until, in time order.
+        """
+        closed = []
+        for interval in intervals or self.intervals:
+            length = interval * NANOS_PER_SECOND
+            bars = self._open[interval]
+            start = self._next_start[interval]
+
+            while start is not None and start + length <= until:
+                bar = bars.pop(start, None)
+                if bar is None and not self.fill_empty:
+                    if not bars:
+                        start = until - until % length  # Nothing pending, skip the gap at once
+                        break
+                    start = min(bars)
+                    continue
+                if bar is None:
+                    bar = Bar(start)
+                record = bar.to_record(self._previous[interval])
+                self._previous[interval] = record
+                closed.append((interval, record))
+                start += length
+
+            self._next_start[interval] = start
+
+        closed.sort(key=lambda item: (item[1]['timestamp'], item[0]))
+        return closed
+
+    def flush(self):
+        """
+        Emit every bar still open, once no more ticks will come.
+        """
+        closed = []
+        for interval, bars in self._open.items():
+            if bars:
+                closed.extend(self._emit(max(bars) + interval * NANOS_PER_SECOND, [interval]))
+        closed.sort(key=lambda item: (item[1]['timestamp'], item[0]))
+        return closed
+
+def market_ticks(data_dir, chunksize=chunked_ingest.CHUNK_SIZE):
+    """
+    The quotes and trades of a market directory as one time-ordered stream of (kind, tick),
+    kind being 'quote' or 'trade'. Quotes come first on equal timestamps, as in the as-of merge.
+    """
+    market_data_files, trade_data_files = chunked_ingest.market_files(data_dir)
+    quote_blocks = chunked_ingest.merge_sorted_streams([
+        chunked_ingest.read_sorted_csv(file, chunked_ingest.QUOTE_COLUMNS, chunksize=chunksize) for file in market_data_files
+    ])
+    trade_blocks = [chunked_ingest.read_sorted_csv(file, chunked_ingest.TRADE_COLUMNS, chunksize=chunksize) for file in trade_data_files[:1]]
+
+    def records(blocks, order, kind):
+        for block in blocks:
+            for tick in block.to_dict('records'):
+                yield tick['timestamp'], order, kind, tick
+
+    streams = [records(quote_blocks, 0, 'quote')] + [records(blocks, 1, 'trade') for blocks in trade_blocks]
+    for _, _, kind, tick in heapq.merge(*streams, key=lambda item: (item[0], item[1])):
+        yield kind, tick
+
+def market_bars(data_dir, intervals=DEFAULT_INTERVALS, allowed_lateness=0.0, fill_empty=True):
+    """
+    Yield the (interval, bar) pairs of a market directory as they close.
+    """
+    aggregator = BarAggregator(intervals, allowed_lateness, fill_empty)
+    for kind, tick in market_ticks(data_dir):
+        if kind == 'quote':
+            yield from aggregator.update_quote(tick)
+        else:
+            yield from aggregator.update_trade(tick)
+    yield from aggregator.flush()
+
+def bars_frame(bars, interval=None):
+    """
+    Collect (interval, bar) pairs into a DataFrame, keeping one interval when given;
+    the frame is what analysis.predict_stock takes.
+    """
+    records = [record for bar_interval, record in bars if interval is None or bar_interval == interval]
+    return pd.DataFrame(records, columns=BAR_FIELDS)
+
+def format_bar(record):
+    """
+    A bar with its timestamp formatted as in streamed_data.json.
+    """
+    return dict(record, timestamp=pd.Timestamp(record['timestamp']).strftime(BAR_TIMESTAMP_FORMAT))
+
+def write_bars_json(bars, path, interval=DEFAULT_INTERVALS[0]):
+    with open(path, 'w') as output_file:
+        json.dump([format_bar(record) for bar_interval, record in bars if bar_interval == interval], output_file, indent=4)
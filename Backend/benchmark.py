@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import tempfile
+import statistics
+import threading
+import numpy as np
+import pandas as pd
+import synthetic_data
+
+def measure(function, repeat):
+    """
+    Run function repeat times and return the wall-clock duration of each run.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def summarize(name, durations, rows=None, **extra):
+    if rows is not None and rows <= 0:
+        raise RuntimeError(f"{name} processed no rows, the run is not a valid measurement")
+    result = {
+        'name': name,
+        'repeat': len(durations),
+        'min_seconds': min(durations),
+        'median_seconds': statistics.median(durations),
+        'mean_seconds': statistics.fmean(durations),
+    }
+    if rows:
+        result['rows'] = rows
+        result['rows_per_second'] = rows / result['median_seconds']
+    result.update(extra)
+    print(f"{name:<40} median {result['median_seconds'] * 1000:10.2f} ms" + (f"  {result['rows_per_second']:12.0f} rows/s" if rows else ""))
+    return result
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def stream_clients(port, n_clients, query):
+    """
+    Connect n_clients WebSocket clients to /stream at once and count the rows each receives.
+    Raises if any client is sent an error instead of the complete stream.
+    """
+    import simple_websocket
+
+    counts = [0] * n_clients
+    errors = []
+
+    def client(index):
+        ws = simple_websocket.Client.connect(f"ws://127.0.0.1:{port}/stream?{query}")
+        try:
+            while True:
+                message = ws.receive(timeout=60)
+                if message is None:
+                    break
+                data = json.loads(message)
+                if isinstance(data, dict) and data.get('status') == 'error':
+                    errors.append(data.get('message'))
+                    break
+                if isinstance(data, dict) and data.get('status') == 'complete':
+                    break
+                counts[index] += data.get('count', 1) if isinstance(data, dict) else 1
+        finally:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(n_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise RuntimeError(f"/stream sent an error to {len(errors)} of {n_clients} clients: {errors[0]}")
+    return counts
+
+def run_benchmarks(data_root, repeat=3, clients=(1, 10), single_rows=200, bars=50_000):
+    """
+    Run every benchmark against the TrainingData tree under data_root and return the results.
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(data_root)  # The backend reads TrainingData relative to the working directory
+
+    import main
+    import analysis
+    import feature_cache
+    import data_processing
+    import features
+
+    main.DATA_DIR = os.path.join(data_root, 'TrainingData', 'Period2')
+    feature_cache.CACHE_DIR = os.path.join(data_root, 'FeatureCache')
+    feature_cache.clear_cache()
+
+    market = main.list_markets()[0]
+    results = []
+
+    # Ingest: CSV read, timestamp parse, as-of merge and features for one market
+    merged_df = main.preprocess_and_label_data(market, 2)
+    results.append(summarize('preprocess_and_label_data', measure(lambda: main.preprocess_and_label_data(market, 2), repeat), len(merged_df)))
+
+    results.append(summarize('load_training_data', measure(lambda: data_processing.load_training_data('TrainingData'), repeat)))
+    training_df = data_processing.load_training_data('TrainingData')
+    results.append(summarize('features.add_features', measure(lambda: features.add_features(training_df.copy()), repeat), len(training_df)))
+    featurized_df = features.add_features(training_df.copy())
+    results.append(summarize('features.label_actions', measure(lambda: features.label_actions(featurized_df['momentum'], featurized_df['volume_ratio']), repeat), len(featurized_df)))
+    results.append(summarize('prepare_data', measure(lambda: data_processing.prepare_data(training_df.copy()), repeat), len(training_df)))
+
+    # Inference, one row at a time and batched; without a model only the fallback would be timed
+    assert main.model is not None, "No usable model in ModelOutput, inference cannot be benchmarked"
+    rows = [row for _, row in merged_df.head(single_rows).iterrows()]
+    results.append(summarize('predict_action (single row)', measure(lambda: [main.predict_action(row) for row in rows], repeat), len(rows)))
+    results.append(summarize('predict_actions (batched)', measure(lambda: main.predict_actions(merged_df), repeat), len(merged_df)))
+
+    # Signals over streamed_data.json style bars
+    bars_df = synthetic_data.generate_bars(bars)
+    results.append(summarize('analysis.predict_stock', measure(lambda: analysis.predict_stock(bars_df), repeat), len(bars_df)))
+
+    # End to end /stream throughput at max replay speed with concurrent clients
+    from werkzeug.serving import make_server
+
+    port = free_port()
+    server = make_server('127.0.0.1', port, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        for n_clients in clients:
+            for wire in ('rows', 'columnar'):
+                query = f"speed=max&queue_size=1000000&format={wire}"
+                counts = []
+                durations = measure(lambda: counts.append(sum(stream_clients(port, n_clients, query))), repeat)
+                results.append(summarize(f'/stream {wire} x{n_clients} clients', durations, int(statistics.median(counts)), clients=n_clients, format=wire))
+    finally:
+        server.shutdown()
+
+    return results
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'cpu_count': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def compare(results, baseline_path):
+    """
+    Print the median time of each benchmark relative to a previous results file.
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = {result['name']: result for result in json.load(baseline_file)['results']}
+
+    print(f"\nCompared with {baseline_path} (ratio < 1 is faster):")
+    for result in results:
+        previous = baseline.get(result['name'])
+        if previous:
+            print(f"{result['name']:<40} {result['median_seconds'] / previous['median_seconds']:6.2f}x")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark ingest, features, inference and streaming on synthetic data.")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file to write the results to")
+    parser.add_argument('--compare', help="Previous results file to compare with")
+    parser.add_argument('--data', help="Existing folder holding TrainingData; synthetic data is generated when omitted")
+    parser.add_argument('--markets', type=int, default=3)
+    parser.add_argument('--quotes', type=int, default=50_000, help="Quotes per market")
+    parser.add_argument('--trades', type=int, default=20_000, help="Trades per market")
+    parser.add_argument('--bars', type=int, default=50_000, help="Bars for analysis.predict_stock")
+    parser.add_argument('--clients', default="1,10", help="Concurrent /stream clients to test")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    baseline = args.compare and os.path.abspath(args.compare)
+    config = vars(args).copy()
+    data_root = args.data and os.path.abspath(args.data)
+    if data_root is None:
+        data_root = tempfile.mkdtemp(prefix='mchacks-bench-')
+        markets = [chr(ord('A') + index) for index in range(args.markets)]
+        synthetic_data.generate_training_data(data_root, periods=2, markets=markets, n_quotes=args.quotes, n_trades=args.trades)
+
+    results = run_benchmarks(data_root, args.repeat, [int(n) for n in args.clients.split(',')], bars=args.bars)
+
+    with open(output, 'w') as output_file:
+        json.dump({'environment': environment(), 'config': config, 'results': results}, output_file, indent=2)
+    print(f"Results written to {output}")
+
+    if baseline:
+        compare(results, baseline)
@@ -0,0 +1,195 @@
+import itertools
+import threading
+from collections import deque
+
+# What to do when a client's queue is full
+OVERFLOW_POLICIES = ('drop_oldest', 'coalesce', 'disconnect')
+
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_OVERFLOW = 'drop_oldest'
+
+_client_ids = itertools.count(1)
+
+class Subscriber:
+    """
+    A connected client: a bounded queue of (market, message) pairs filled by the market
+    producers and drained by the single thread that writes to the client's socket.
+    """
+
+    def __init__(self, subscription, queue_size=DEFAULT_QUEUE_SIZE, overflow=DEFAULT_OVERFLOW):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow}, expected one of {OVERFLOW_POLICIES}")
+
+        self.client_id = next(_client_ids)
+        self.subscription = subscription  # Can be changed by the client while streaming
+        self.queue_size = max(1, int(queue_size))
+        self.overflow = overflow
+        self.dropped = 0
+        self.disconnected = False  # Set when the client was cut off for falling behind
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def put(self, market, message):
+        """
+        Queue a message, applying the overflow policy when the queue is full.
+        With coalesce, a message replaces the pending message of its market in place, so at
+        most one message per market waits in the queue and it is always the latest one.
+        """
+        with self._condition:
+            if self._closed:
+                return
+
+            if self.overflow == 'coalesce' and self._replace_pending(market, message):
+                self.dropped += 1
+                self._condition.notify()
+                return
+
+            if len(self._queue) >= self.queue_size:
+                if self.overflow == 'disconnect':
+                    self.disconnected = True
+                    self._closed = True
+                    self._condition.notify()
+                    return
+                self._drop_oldest()
+                self.dropped += 1
+
+            self._queue.append((market, message))
+            self._condition.notify()
+
+    def _replace_pending(self, market, message):
+        if market is None:
+            return False  # Errors and the end-of-stream marker are never merged
+
+        for index, (queued_market, queued_message) in enumerate(self._queue):
+            if queued_market == market and queued_message is not None:
+                self._queue[index] = (market, message)
+                return True
+        return False
+
+    def _drop_oldest(self):
+        # Drop the oldest tick, never the end-of-stream marker
+        for index, (queued_market, message) in enumerate(self._queue):
+            if message is not None:
+                del self._queue[index]
+                return
+
+    def finish(self):
+        """
+        Mark the stream as done; the marker bypasses the size limit so it is never dropped.
+        """
+        with self._condition:
+            if not self._closed:
+                self._queue.append((None, None))
+                self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Wait for the next (market, message) pair; message is None when the stream is done.
+        Returns None once the subscriber is closed or the timeout expires.
+        """
+        with self._condition:
+            while not self._queue and not self._closed:
+                if not self._condition.wait(timeout):
+                    return None
+            if self._closed:
+                return None
+            return self._queue.popleft()
+
+    def get_many(self, max_items, timeout=None):
+        """
+        Wait for at least one (market, message) pair, then take whatever else is already
+        queued, up to max_items. Returns an empty list once closed or on timeout.
+        """
+        first = self.get(timeout)
+        if first is None:
+            return []
+
+        items = [first]
+        with self._condition:
+            while self._queue and len(items) < max_items and not self._closed:
+                items.append(self._queue.popleft())
+        return items
+
+    def qsize(self):
+        with self._condition:
+            return len(self._queue)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+class BroadcastHub:
+    """
+    Runs at most one producer thread per channel and fans every message it produces out
+    to all the subscribers of that channel, so the work per tick does not grow with clients.
+    """
+
+    def __init__(self, load_messages):
+        self.load_messages = load_messages  # load_messages(channel) -> iterable of (market, message)
+
+        self._lock = threading.Lock()
+        self._subscribers = {}  # channel -> set of Subscriber
+        self._producers = {}  # channel -> Thread
+
+    def subscribe(self, channel, subscription, queue_size=DEFAULT_QUEUE_SIZE, overflow=DEFAULT_OVERFLOW):
+        subscriber = Subscriber(subscription, queue_size, overflow)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscriber)
+            if channel not in self._producers:
+                producer = threading.Thread(target=self._produce, args=(channel,), daemon=True)
+                self._producers[channel] = producer
+                producer.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+        with self._lock:
+            for subscribers in self._subscribers.values():
+                subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        return len(self.subscribers())
+
+    def subscribers(self):
+        with self._lock:
+            return list(set().union(*self._subscribers.values())) if self._subscribers else []
+
+    def wanted_markets(self, channel):
+        """
+        Markets at least one subscriber of the channel watches; the others need not be computed.
+        None once the channel has no subscribers left.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        if not subscribers:
+            return None
+        return set().union(*(subscriber.subscription.markets for subscriber in subscribers))
+
+    def _current_subscribers(self, channel):
+        with self._lock:
+            return list(self._subscribers.get(channel, ()))
+
+    def _produce(self, channel):
+        try:
+            for market, message in self.load_messages(channel):
+                subscribers = self._current_subscribers(channel)
+                if not subscribers:
+                    break  # Nobody is watching this channel anymore, stop computing it
+
+                for subscriber in subscribers:
+                    if subscriber.subscription.accepts(market, message):
+                        subscriber.put(market, message)
+
+        except Exception as e:
+            for subscriber in self._current_subscribers(channel):
+                subscriber.put(None, {"status": "error", "message": f"Error streaming {channel}: {str(e)}"})
+
+        finally:
+            with self._lock:
+                del self._producers[channel]
+                subscribers = self._subscribers.pop(channel, set())
+            for subscriber in subscribers:
+                subscriber.finish()
@@ -1,35 +1,218 @@
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+import feature_cache
+import features
+from chunked_ingest import load_market, market_folders
 
-def plot_chart(file_path, period, market):
-    # Load the CSV file
-    df = pd.read_csv(file_path)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CHART_DIR = os.path.join(BASE_DIR, 'Charts')
 
-    # Convert timestamp to datetime format for better plotting
-    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+# Record of the source files every rendered chart was drawn from
+CHART_MANIFEST = 'chart_manifest.json'
+
+# Chart size in pixels; every series is downsampled to about one point per horizontal pixel
+DEFAULT_WIDTH = 1000
+DEFAULT_HEIGHT = 600
+DEFAULT_DPI = 100
+FORMATS = ('png', 'svg')
+
+# Line style of each label series
+LABEL_STYLES = {
+    'Buy': {'color': 'green', 'lw': 2},  # Green for Buy line
+    'Sell': {'color': 'red', 'lw': 2},  # Red for Sell line
+    'Hold': {'color': 'orange', 'lw': 2, 'alpha': 0.3},  # Orange for Hold line with less opacity
+}
+
+def lttb(x, y, threshold):
+    """
+    Indices of the points Largest-Triangle-Three-Buckets keeps to draw a line of threshold
+    points that looks like the full one. The first and last points are always kept, and from
+    every bucket in between the point forming the largest triangle with the point kept before
+    it and the mean of the next bucket.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Bucket b holds the points edges[b]:edges[b + 1], the first and last points are left out
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
 
-    # Drop rows with invalid or missing timestamps
-    df = df.dropna(subset=['timestamp'])
+    # Mean of the bucket after each bucket, the last bucket looking at the last point
+    sum_x = np.concatenate(([0.0], np.cumsum(x)))
+    sum_y = np.concatenate(([0.0], np.cumsum(y)))
+    sizes = edges[2:] - edges[1:-1]
+    next_x = np.append((sum_x[edges[2:]] - sum_x[edges[1:-1]]) / sizes, x[-1])
+    next_y = np.append((sum_y[edges[2:]] - sum_y[edges[1:-1]]) / sizes, y[-1])
 
-    # Plot the price vs timestamp
-    plt.figure(figsize=(10, 6))
-    plt.plot(df['timestamp'], df['price'], label='Price', color='b', alpha=0.7)  # Price line with some transparency
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = kept = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        area = np.abs((x[kept] - next_x[bucket]) * (y[start:end] - y[kept])
+                      - (x[kept] - x[start:end]) * (next_y[bucket] - y[kept]))
+        kept = start + int(np.argmax(area))
+        selected[bucket + 1] = kept
+    selected[-1] = n - 1
+    return selected
+
+def downsample(timestamps, prices, threshold):
+    """
+    A (timestamps, prices) series reduced to about threshold points with lttb.
+    """
+    # Offsets from the first timestamp keep the nanoseconds exact as floats
+    times = timestamps.view(np.int64)
+    selected = lttb(times - times[0] if len(times) else times, prices, threshold)
+    return timestamps[selected], prices[selected]
+
+def chart_figure(timestamps, prices, labels, period, market, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, dpi=DEFAULT_DPI, figure=None):
+    """
+    Draw the price line and the Buy, Sell and Hold lines. Without a figure to draw on, a new
+    Figure is made outside pyplot, so nothing depends on an interactive backend.
+    Each line is downsampled to the chart width.
+    """
+    timestamps = np.asarray(timestamps, dtype='datetime64[ns]')
+    prices = np.asarray(prices, dtype=np.float64)
+    labels = np.asarray(labels)
+
+    # Drop rows with invalid or missing timestamps or prices
+    valid = ~np.isnat(timestamps) & ~np.isnan(prices)
+    timestamps, prices, labels = timestamps[valid], prices[valid], labels[valid]
+
+    if figure is None:
+        figure = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    axes = figure.add_subplot()
+    axes.plot(*downsample(timestamps, prices, width), label='Price', color='b', alpha=0.7)  # Price line with some transparency
+
+    # Rows of every label from one grouping pass instead of a boolean mask per label
+    label_rows = pd.Series(labels).groupby(labels, sort=False).indices
+    for label, style in LABEL_STYLES.items():
+        rows = label_rows.get(label, np.array([], dtype=np.int64))
+        axes.plot(*downsample(timestamps[rows], prices[rows], width), label=label, **style)
 
-    # Plot Buy, Sell, and Hold as lines
-    plt.plot(df[df['label'] == 'Buy']['timestamp'], df[df['label'] == 'Buy']['price'], color='green', label='Buy', lw=2)  # Green for Buy line
-    plt.plot(df[df['label'] == 'Sell']['timestamp'], df[df['label'] == 'Sell']['price'], color='red', label='Sell', lw=2)  # Red for Sell line
-    plt.plot(df[df['label'] == 'Hold']['timestamp'], df[df['label'] == 'Hold']['price'], color='orange', label='Hold', lw=2, alpha=0.3)  # Orange for Hold line with less opacity
     # Adding title and labels
-    plt.title(f"Price Over Period {period} Company {market}")
-    plt.xlabel('Timestamp')
-    plt.ylabel('Price')
+    axes.set_title(f"Price Over Period {period} Company {market}")
+    axes.set_xlabel('Timestamp')
+    axes.set_ylabel('Price')
 
     # Rotate the x-axis labels for better readability
-    plt.xticks(rotation=45, ha='right')
+    for tick in axes.get_xticklabels():
+        tick.set_rotation(45)
+        tick.set_horizontalalignment('right')
 
     # Add a legend to indicate which color corresponds to which label
-    plt.legend()
+    axes.legend()
+    figure.tight_layout()
+    return figure
+
+def plot_chart(file_path, period, market, output_path=None, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, dpi=DEFAULT_DPI):
+    """
+    Chart a labeled CSV file with timestamp, price and label columns. The chart is saved to
+    output_path, as PNG or SVG by its extension, or shown in a window when none is given.
+    """
+    # Load the columns the chart needs from the CSV file
+    df = pd.read_csv(file_path, usecols=['timestamp', 'price', 'label'])
+
+    # Convert timestamp to datetime format for better plotting
+    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
 
-    # Display the plot
-    plt.tight_layout()
+    if output_path is not None:
+        chart_figure(df['timestamp'], df['price'], df['label'], period, market, width, height, dpi).savefig(output_path)
+        return output_path
+
+    # Only the interactive path needs pyplot and a GUI backend
+    import matplotlib.pyplot as plt
+    chart_figure(df['timestamp'], df['price'], df['label'], period, market, width, height, dpi,
+                 plt.figure(figsize=(width / dpi, height / dpi), dpi=dpi))
     plt.show()
+
+def chart_path(output_folder, period, market, chart_format):
+    return os.path.join(output_folder, f"{period}_{market}.{chart_format}")
+
+def _render_market_task(task):
+    period, market, market_folder, output_folder, formats, width, height, dpi = task
+    merged_df = load_market(market_folder)
+    if merged_df is None:
+        return period, market, None
+    merged_df = features.featurize(merged_df)
+
+    figure = chart_figure(merged_df['timestamp'], merged_df['price'], merged_df['label'],
+                          period.removeprefix('Period'), market, width, height, dpi)
+    paths = [chart_path(output_folder, period, market, chart_format) for chart_format in formats]
+    for path, chart_format in zip(paths, formats):
+        figure.savefig(path, format=chart_format)
+    return period, market, paths
+
+def render_charts(base_data_folder="TrainingData", output_folder=CHART_DIR, formats=('png',), width=DEFAULT_WIDTH,
+                  height=DEFAULT_HEIGHT, dpi=DEFAULT_DPI, max_workers=None, force=False):
+    """
+    Render the chart of every (period, market) folder in a process pool.
+    A chart is skipped while its source files, the feature schema and the chart settings are
+    unchanged since it was last rendered and its files still exist, unless force is set.
+    Returns the rendered and skipped "period/market" keys.
+    """
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        raise ValueError(f"Unknown chart formats {sorted(unknown)}, expected some of {FORMATS}")
+
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = os.path.join(output_folder, CHART_MANIFEST)
+    settings = {'formats': sorted(formats), 'width': width, 'height': height, 'dpi': dpi}
+    try:
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        manifest = {}
+    charts = manifest.get('charts', {}) if manifest.get('settings') == settings else {}
+
+    tasks, fingerprints, skipped = [], {}, []
+    for period, market, market_folder in market_folders(base_data_folder):
+        key = f"{period}/{market}"
+        fingerprints[key] = feature_cache.source_fingerprint(market_folder)
+        up_to_date = charts.get(key) == fingerprints[key] and all(
+            os.path.exists(chart_path(output_folder, period, market, chart_format)) for chart_format in formats)
+        if up_to_date and not force:
+            skipped.append(key)
+            continue
+        tasks.append((period, market, market_folder, output_folder, tuple(formats), width, height, dpi))
+
+    rendered = []
+    if tasks:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for period, market, paths in executor.map(_render_market_task, tasks):
+                key = f"{period}/{market}"
+                if paths is None:
+                    print(f"No market or trade data files found for {market} in {period}.")
+                    charts.pop(key, None)
+                    continue
+                charts[key] = fingerprints[key]
+                rendered.append(key)
+                print(f"Rendered {', '.join(paths)}")
+
+        with open(manifest_path, 'w') as manifest_file:
+            json.dump({'settings': settings, 'charts': charts}, manifest_file, indent=2)
+
+    return rendered, skipped
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render the price and label chart of every period and market of TrainingData.")
+    parser.add_argument('--data', default="TrainingData")
+    parser.add_argument('--output', default=CHART_DIR)
+    parser.add_argument('--format', default='png', help="Comma separated chart formats: png, svg")
+    parser.add_argument('--width', type=int, default=DEFAULT_WIDTH, help="Chart width in pixels")
+    parser.add_argument('--height', type=int, default=DEFAULT_HEIGHT, help="Chart height in pixels")
+    parser.add_argument('--dpi', type=int, default=DEFAULT_DPI)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true', help="Render every chart even if its data is unchanged")
+    args = parser.parse_args()
+
+    rendered, skipped = render_charts(args.data, args.output, args.format.split(','), args.width, args.height,
+                                      args.dpi, args.workers, args.force)
+    print(f"Rendered {len(rendered)} charts, {len(skipped)} unchanged.")
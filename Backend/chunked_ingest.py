@@ -0,0 +1,285 @@
+import os
+import numpy as np
+import pandas as pd
+import metrics
+from features import SMOOTHING_WINDOW, label_actions, rolling_mean
+
+# Number of CSV rows read at a time; peak memory is a small multiple of this
+CHUNK_SIZE = 100_000
+
+timestamp_format = "%H:%M:%S.%f"
+QUOTE_COLUMNS = ["bidVolume", "bidPrice", "askVolume", "askPrice", "timestamp"]
+TRADE_COLUMNS = ["price", "volume", "timestamp"]
+
+# Explicit dtypes for the raw CSV files. Training reads float32; serving reads float64 so the
+# prices sent to clients keep their exact decimal values
+MARKET_DATA_DTYPES = {"bidVolume": "float32", "bidPrice": "float32", "askVolume": "float32", "askPrice": "float32", "timestamp": str}
+TRADE_DATA_DTYPES = {"price": "float32", "volume": "float32", "timestamp": str}
+
+def csv_dtypes(dtypes, float_dtype):
+    return {column: float_dtype if dtype == "float32" else dtype for column, dtype in dtypes.items()}
+
+def read_sorted_csv(path, columns, dtype=None, chunksize=CHUNK_SIZE, timestamp_format=timestamp_format):
+    """
+    Read a CSV file in chunks with parsed timestamps.
+    The file must already be in timestamp order, which is how the exchange writes it.
+    """
+    last_timestamp = None
+    for chunk in pd.read_csv(path, usecols=columns, dtype=dtype, chunksize=chunksize):
+        chunk = chunk[columns]
+        chunk['timestamp'] = pd.to_datetime(chunk['timestamp'], format=timestamp_format, errors='coerce')
+        chunk = chunk.dropna(subset=['timestamp'])
+        if chunk.empty:
+            continue
+
+        chunk = chunk.sort_values('timestamp', kind='mergesort')
+        if last_timestamp is not None and chunk['timestamp'].iloc[0] < last_timestamp:
+            raise ValueError(f"{path} is not sorted by timestamp and cannot be read in chunks")
+        last_timestamp = chunk['timestamp'].iloc[-1]
+
+        yield chunk.reset_index(drop=True)
+
+def merge_sorted_streams(streams):
+    """
+    k-way merge of several streams of timestamp-sorted blocks into one sorted stream of blocks.
+    Every step emits the rows up to the smallest last timestamp among the buffered blocks,
+    so at most one block per stream is held in memory.
+    """
+    streams = [iter(stream) for stream in streams]
+    buffers = [None] * len(streams)
+    exhausted = [False] * len(streams)
+
+    while True:
+        # Refill the empty buffers
+        for index, stream in enumerate(streams):
+            if (buffers[index] is None or buffers[index].empty) and not exhausted[index]:
+                buffers[index] = next(stream, None)
+                if buffers[index] is None:
+                    exhausted[index] = True
+
+        active = [buffer for buffer in buffers if buffer is not None and not buffer.empty]
+        if not active:
+            return
+
+        # Streams that may still produce rows bound how far we can safely emit
+        pending = [buffer['timestamp'].iloc[-1] for index, buffer in enumerate(buffers)
+                   if buffer is not None and not buffer.empty and not exhausted[index]]
+        watermark = min(pending) if pending else None
+
+        parts = []
+        for index, buffer in enumerate(buffers):
+            if buffer is None or buffer.empty:
+                continue
+            if watermark is None:
+                cut = len(buffer)
+            else:
+                cut = buffer['timestamp'].searchsorted(watermark, side='right')
+            parts.append(buffer.iloc[:cut])
+            buffers[index] = buffer.iloc[cut:]
+
+        # Stable sort keeps equal timestamps in file order
+        yield pd.concat(parts, ignore_index=True).sort_values('timestamp', kind='mergesort', ignore_index=True)
+
+def asof_join_blocks(trade_blocks, quote_blocks):
+    """
+    Backward as-of join of sorted trade blocks with sorted quote blocks in a single forward pass.
+    Each trade gets the last quote at or before its timestamp, like
+    pd.merge_asof(trades, quotes, on='timestamp', direction='backward').
+    """
+    quote_blocks = iter(quote_blocks)
+    quote_buffer = None
+    quotes_exhausted = False
+    carry = None  # Last quote already passed, applies to trades before the buffered quotes
+
+    def join(trades, quotes=None):
+        frames = [frame for frame in (carry, quotes) if frame is not None]
+        if frames:
+            right = pd.concat(frames, ignore_index=True)
+        elif quote_buffer is not None:
+            right = quote_buffer.iloc[:0]  # No quote before these trades yet
+        else:
+            # The market has no quotes at all: every quote column is missing
+            right = pd.DataFrame({column: pd.Series(dtype=float) for column in QUOTE_COLUMNS})
+            right['timestamp'] = right['timestamp'].astype(trades['timestamp'].dtype)
+        return pd.merge_asof(trades, right, on='timestamp', direction='backward')
+
+    for trades in trade_blocks:
+        parts = []
+        while not trades.empty:
+            if (quote_buffer is None or quote_buffer.empty) and not quotes_exhausted:
+                quote_buffer = next(quote_blocks, None)
+                quotes_exhausted = quote_buffer is None
+
+            if quotes_exhausted:
+                parts.append(join(trades))
+                break
+
+            quote_timestamps = quote_buffer['timestamp']
+
+            # Trades before the first buffered quote only see the carried quote
+            cut = trades['timestamp'].searchsorted(quote_timestamps.iloc[0], side='left')
+            if cut:
+                parts.append(join(trades.iloc[:cut]))
+                trades = trades.iloc[cut:]
+
+            # Trades before the last buffered quote are fully determined by this buffer
+            cut = trades['timestamp'].searchsorted(quote_timestamps.iloc[-1], side='left')
+            if cut:
+                parts.append(join(trades.iloc[:cut], quote_buffer))
+                trades = trades.iloc[cut:]
+
+            # The remaining trades are at or after the last buffered quote, move on to the next quotes
+            if not trades.empty:
+                carry = quote_buffer.iloc[-1:]
+                quote_buffer = None
+
+        if parts:
+            yield pd.concat(parts, ignore_index=True)
+
+def load_market(market_folder, chunksize=None, float_dtype="float32"):
+    """
+    Load, clean and as-of merge the quote and trade files of one market folder.
+    With a chunksize the files are read and joined in bounded chunks instead of all at once.
+    float_dtype is the dtype of the price and volume columns.
+    Returns None when the folder has no market data or no trade data.
+    """
+    quote_dtypes = csv_dtypes(MARKET_DATA_DTYPES, float_dtype)
+    trade_dtypes = csv_dtypes(TRADE_DATA_DTYPES, float_dtype)
+    if chunksize:
+        merged_blocks = list(iter_merged_blocks(market_folder, chunksize, quote_dtypes, trade_dtypes, timestamp_format))
+        return pd.concat(merged_blocks, ignore_index=True) if merged_blocks else None
+
+    # Get all relevant market data files
+    market_data_files, trade_data_files = market_files(market_folder)
+    if not market_data_files or not trade_data_files:
+        return None
+
+    # Load the data with explicit dtypes so pandas does not have to infer them
+    with metrics.timed('csv_read'):
+        bid_ask_df = pd.concat([pd.read_csv(file, usecols=list(quote_dtypes), dtype=quote_dtypes) for file in market_data_files], ignore_index=True)
+        price_volume_df = pd.read_csv(trade_data_files[0], usecols=list(trade_dtypes), dtype=trade_dtypes)
+
+    # Process timestamps and clean data
+    with metrics.timed('timestamp_parse'):
+        bid_ask_df['timestamp'] = pd.to_datetime(bid_ask_df['timestamp'], format=timestamp_format, errors='coerce')
+        price_volume_df['timestamp'] = pd.to_datetime(price_volume_df['timestamp'], format=timestamp_format, errors='coerce')
+    bid_ask_df = bid_ask_df.dropna(subset=['timestamp'])
+    price_volume_df = price_volume_df.dropna(subset=['timestamp'])
+
+    # Sort data by timestamp and merge dataframes based on timestamp; the sort is stable so
+    # rows on one timestamp keep their file order, as in the chunked reader
+    with metrics.timed('asof_merge'):
+        bid_ask_df = bid_ask_df.sort_values('timestamp', kind='mergesort')
+        price_volume_df = price_volume_df.sort_values('timestamp', kind='mergesort')
+        return pd.merge_asof(price_volume_df, bid_ask_df, on='timestamp', direction='backward')
+
+def market_folders(base_data_folder="TrainingData"):
+    """
+    (period, market, folder) for every market folder under base_data_folder.
+    """
+    folders = []
+    for period in sorted(os.listdir(base_data_folder)):
+        period_folder = os.path.join(base_data_folder, period)
+        if not os.path.isdir(period_folder):  # Check if it is a valid period folder
+            continue
+        for market in sorted(os.listdir(period_folder)):
+            market_folder = os.path.join(period_folder, market)
+            if os.path.isdir(market_folder):  # Check if it's a valid market folder
+                folders.append((period, market, market_folder))
+    return folders
+
+def market_files(data_dir):
+    all_files = sorted(os.listdir(data_dir))
+    market_data_files = [os.path.join(data_dir, file) for file in all_files if "market_data" in file and file.endswith(".csv")]
+    trade_data_files = [os.path.join(data_dir, file) for file in all_files if "trade_data" in file and file.endswith(".csv")]
+    return market_data_files, trade_data_files
+
+def iter_merged_blocks(data_dir, chunksize=CHUNK_SIZE, quote_dtypes=None, trade_dtypes=None, timestamp_format=timestamp_format):
+    """
+    Yield the trades of a market directory joined with their quotes, one bounded block at a time.
+    """
+    market_data_files, trade_data_files = market_files(data_dir)
+    if not market_data_files or not trade_data_files:
+        return
+
+    quote_blocks = merge_sorted_streams([
+        read_sorted_csv(file, QUOTE_COLUMNS, quote_dtypes, chunksize, timestamp_format) for file in market_data_files
+    ])
+    trade_blocks = read_sorted_csv(trade_data_files[0], TRADE_COLUMNS, trade_dtypes, chunksize, timestamp_format)
+
+    yield from asof_join_blocks(trade_blocks, quote_blocks)
+
+class BlockFeaturizer:
+    """
+    Computes the features and labels of consecutive merged blocks as if they were one frame.
+    The last prices are carried across blocks to start the next block's rolling windows, and the
+    rows of the last second are held back until that second is complete so avg_price_per_second
+    covers the whole second.
+    """
+
+    def __init__(self, window=SMOOTHING_WINDOW):
+        self.window = window
+        self.history = np.array([])  # Latest prices, the start of the next block's first windows
+        self.prev_smoothed_price = np.nan
+        self.held_rows = None
+
+    def featurize(self, merged_df):
+        """
+        Add the row features of a block and return the rows whose second is complete.
+        """
+        merged_df = merged_df.copy()
+
+        price = merged_df['price'].to_numpy(dtype=np.float64)
+        smoothed_price = rolling_mean(price, self.window, self.history)
+        self.history = np.concatenate((self.history, price))[-self.window:]
+        previous = np.concatenate(([self.prev_smoothed_price], smoothed_price[:-1]))
+        if len(smoothed_price):
+            self.prev_smoothed_price = smoothed_price[-1]
+
+        merged_df['smoothed_price'] = smoothed_price
+        merged_df['spread'] = merged_df['askPrice'] - merged_df['bidPrice']
+        merged_df['momentum'] = smoothed_price - previous
+        merged_df['volume_ratio'] = merged_df['bidVolume'] / (merged_df['askVolume'] + 1e-6)
+
+        if self.held_rows is not None:
+            merged_df = pd.concat([self.held_rows, merged_df], ignore_index=True)
+            self.held_rows = None
+        if merged_df.empty:
+            return merged_df
+
+        # The last second may continue in the next block
+        timestamp_second = merged_df['timestamp'].dt.floor('s')
+        cut = timestamp_second.searchsorted(timestamp_second.iloc[-1], side='left')
+        self.held_rows = merged_df.iloc[cut:].reset_index(drop=True)
+        return self._close_seconds(merged_df.iloc[:cut])
+
+    def flush(self):
+        """
+        Return the held back rows once no more blocks will come.
+        """
+        if self.held_rows is None:
+            return None
+        rows, self.held_rows = self.held_rows, None
+        return self._close_seconds(rows)
+
+    def _close_seconds(self, merged_df):
+        merged_df = merged_df.copy()
+        timestamp_second = merged_df['timestamp'].dt.floor('s')
+        merged_df['avg_price_per_second'] = merged_df.groupby(timestamp_second)['price'].transform('mean')
+        merged_df['label'] = label_actions(merged_df['momentum'], merged_df['volume_ratio'])
+        return merged_df
+
+def iter_featurized_blocks(data_dir, chunksize=CHUNK_SIZE, quote_dtypes=None, trade_dtypes=None, timestamp_format=timestamp_format):
+    """
+    Out-of-core counterpart of preprocess_and_label_data: yield merged, featurized and labeled
+    blocks of a market directory while holding only a few chunks in memory.
+    """
+    featurizer = BlockFeaturizer()
+    for merged_df in iter_merged_blocks(data_dir, chunksize, quote_dtypes, trade_dtypes, timestamp_format):
+        block = featurizer.featurize(merged_df)
+        if not block.empty:
+            yield block
+
+    block = featurizer.flush()
+    if block is not None and not block.empty:
+        yield block
@@ -1,53 +1,97 @@
 import os
-import pandas as pd
+import json
+import time
 import pickle
+import shutil
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import feature_cache
+import features
+from chunked_ingest import MARKET_DATA_DTYPES, TRADE_DATA_DTYPES, csv_dtypes, iter_featurized_blocks, load_market, market_folders
+from forest_engine import export_forest
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split, StratifiedKFold, cross_val_score
-from sklearn.metrics import classification_report
-
-# Function to engineer features for the model
-def engineer_features(data):
-    data['smoothed_price'] = data['price'].rolling(window=10, min_periods=1).mean()
-    data['spread'] = data['askPrice'] - data['bidPrice']
-    data['momentum'] = data['smoothed_price'] - data['smoothed_price'].shift(1)
-    data['volume_ratio'] = data['bidVolume'] / (data['askVolume'] + 1e-6)
-    
-    # Calculate average price for a given second
-    data['timestamp_second'] = data['timestamp'].dt.floor('s')  # Round down timestamp to the nearest second
-    avg_price_per_second = data.groupby('timestamp_second')['price'].mean().reset_index(name='avg_price_per_second')
-    
-    # Merge the average price back into the original data
-    data = pd.merge(data, avg_price_per_second, on='timestamp_second', how='left')
-    
-    return data
-
-# Labeling function based on momentum and volume ratio
-def label_entry(row):
-    if row['momentum'] > 0 and row['volume_ratio'] > 1:
-        return "Buy"
-    elif row['momentum'] < 0 and row['volume_ratio'] < 1:
-        return "Sell"
-    else:
-        return "Hold"
+from sklearn.model_selection import train_test_split, StratifiedKFold, cross_val_predict
+from sklearn.metrics import classification_report, accuracy_score
 
 # Prepare the data for training/testing
 def prepare_data(data, is_test=False):
-    data = engineer_features(data)
-    
-    # For training, apply the labeling
-    if not is_test:
-        data['label'] = data.apply(label_entry, axis=1)
-        data['label'] = data['label'].astype(str)
-
-    features = data[['smoothed_price', 'spread', 'momentum', 'volume_ratio', 'avg_price_per_second']]  # Include avg price as a feature
+    data = features.add_features(data)
+    features_df = data[features.FEATURE_COLUMNS]
     if is_test:
-        return features
-    else:
-        labels = data['label'].values
-        return features, labels
+        return features_df
+
+    # For training, label every row in one vectorized pass
+    labels = features.label_actions(data['momentum'], data['volume_ratio']).astype(str)
+    return features_df, labels
+
+# Model trained when none is passed in
+def default_model(n_jobs=-1):
+    # Handle class imbalance by setting class weights to 'balanced'
+    return RandomForestClassifier(class_weight='balanced', n_estimators=100, max_depth=10, random_state=42, n_jobs=n_jobs)
+
+@contextmanager
+def timed_stage(timings, stage):
+    """
+    Add the duration of a with block to timings[stage].
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+def print_timings(timings):
+    total = sum(timings.values())
+    print("Stage timings: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()) + f" (total {total:.2f}s)")
+
+def cross_validate(model, X_train, y_train, n_splits=5, n_jobs=-1):
+    """
+    Stratified k-fold out-of-fold predictions, the folds fitted in parallel.
+    The same predictions give both the fold accuracies and the classification report,
+    so the model never has to predict its own training set.
+    """
+    cv = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=42)
+    fold_model = clone(model).set_params(n_jobs=1)  # The folds already use every core
+    y_pred = cross_val_predict(fold_model, X_train, y_train, cv=cv, n_jobs=n_jobs)
+
+    y_train = np.asarray(y_train)
+    scores = np.array([accuracy_score(y_train[test], y_pred[test]) for _, test in cv.split(X_train, y_train)])
+    print(f"Cross-validation scores: {scores}")
+    print(f"Average CV accuracy: {scores.mean()}")
+    print("Out-of-fold classification report:")
+    print(classification_report(y_train, y_pred, labels=["Buy", "Sell", "Hold"], zero_division=0))
+    return scores
+
+def save_model(model, output_folder):
+    # The server prefers the compiled forest, so one that does not match the saved model
+    # is removed rather than left behind
+    compiled_folder = os.path.join(output_folder, 'compiled_forest')
+
+    # The feature schema goes next to the model so the server can refuse a mismatched one
+    try:
+        model_filename = os.path.join(output_folder, 'trained_model.pkl')
+        with open(model_filename, 'wb') as model_file:
+            pickle.dump(model, model_file)
+        features.save_schema(output_folder)
+        print(f"Model saved to {model_filename}")
+    except Exception as e:
+        print(f"Error saving model: {e}")
+        shutil.rmtree(compiled_folder, ignore_errors=True)
+        return
+
+    # Export the flat node arrays the server loads without sklearn
+    try:
+        export_forest(model, compiled_folder, features.feature_schema())
+        print(f"Compiled model saved to {compiled_folder}")
+    except Exception as e:
+        print(f"Error compiling model, removed {compiled_folder}: {e}")
+        shutil.rmtree(compiled_folder, ignore_errors=True)
 
 # Function to train and evaluate the model with cross-validation and class balancing
-def train_and_evaluate_with_cv(merged_df, model, output_folder, test_data=None):
+def train_and_evaluate_with_cv(merged_df, model, output_folder, test_data=None, n_jobs=-1):
     # Ensure the output folder exists
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
@@ -57,107 +101,238 @@ def train_and_evaluate_with_cv(merged_df, model, output_folder, test_data=None):
         print("No data available for training. Exiting.")
         return
 
+    timings = {}
+
     # Prepare training data
-    X_train, y_train = prepare_data(merged_df)
+    with timed_stage(timings, 'features'):
+        X_train, y_train = prepare_data(merged_df)
 
     # Check if there are enough samples to split
     if len(X_train) < 2:  # At least 2 samples needed for train/test split
         print("Not enough data for training and validation split. Exiting.")
         return
 
-    # Handle class imbalance by setting class weights to 'balanced'
-    model = RandomForestClassifier(class_weight='balanced', n_estimators=100, max_depth=10, random_state=42)
+    if model is None:
+        model = default_model(n_jobs)
 
     # Use StratifiedKFold for cross-validation to handle class imbalance
-    cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
-    scores = cross_val_score(model, X_train, y_train, cv=cv, scoring='accuracy')
-
-    print(f"Cross-validation scores: {scores}")
-    print(f"Average CV accuracy: {scores.mean()}")
+    with timed_stage(timings, 'cross_validation'):
+        cross_validate(model, X_train, y_train, n_jobs=n_jobs)
 
     # Train the model on the full training data
-    model.fit(X_train, y_train)
+    with timed_stage(timings, 'fit'):
+        model.fit(X_train, y_train)
 
-    # Evaluate on validation set
-    y_pred = model.predict(X_train)
-    print("Classification report on Training Set:")
-    print(classification_report(y_train, y_pred, target_names=["Buy", "Sell", "Hold"]))
-
-    try:
-        model_filename = os.path.join(output_folder, 'trained_model.pkl')
-        with open(model_filename, 'wb') as model_file:
-            pickle.dump(model, model_file)
-        print(f"Model saved to {model_filename}")
-    except Exception as e:
-        print(f"Error saving model: {e}")
+    with timed_stage(timings, 'save'):
+        save_model(model, output_folder)
 
     # If test data is provided, evaluate on the test set
     if test_data is not None:
-        X_test = prepare_data(test_data, is_test=True)
-        y_test_pred = model.predict(X_test)
-        test_data['predicted_label'] = y_test_pred
+        with timed_stage(timings, 'test'):
+            X_test = prepare_data(test_data, is_test=True)
+            y_test_pred = model.predict(X_test)
+            test_data['predicted_label'] = y_test_pred
 
-        # Save the predictions to the specified folder
-        output_file = os.path.join(output_folder, "predicted_data.csv")
-        test_data.to_csv(output_file, index=False)
+            # Save the predictions to the specified folder
+            output_file = os.path.join(output_folder, "predicted_data.csv")
+            test_data.to_csv(output_file, index=False)
         print(f"Test data predictions saved to {output_file}.")
 
+    print_timings(timings)
+    return model
+
+def _load_market_task(task):
+    period, market, market_folder, chunksize = task
+    return period, market, load_market(market_folder, chunksize)
+
+def load_training_data(base_data_folder="TrainingData", max_workers=None, chunksize=None):
+    """
+    Load every (period, market) folder under base_data_folder in a process pool and
+    concatenate the merged frames once at the end.
+    """
+    tasks = [(period, market, market_folder, chunksize) for period, market, market_folder in market_folders(base_data_folder)]
+
+    merged_dfs = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for period, market, merged_df in executor.map(_load_market_task, tasks):
+            if merged_df is None:
+                print(f"No market or trade data files found for {market} in {period}.")
+                continue
+            merged_dfs.append(merged_df)
+            print(f"Processed data for {market} in {period}.")
+
+    if not merged_dfs:
+        return pd.DataFrame()
+    return pd.concat(merged_dfs, ignore_index=True)
+
+# Folder the per-market training matrices are cached in
+TRAINING_CACHE_DIR = os.path.join(feature_cache.CACHE_DIR, 'Training')
+
+# Record of the market folders a saved model was trained on, used by incremental training
+TRAINING_MANIFEST = 'training_manifest.json'
+
+def training_matrix(market_folder, chunksize=None):
+    """
+    Features (float32) and labels of one market folder, or None without data. With a
+    chunksize the folder is read, merged and featurized in blocks of about that many rows,
+    so only the float32 matrix is ever held whole; the result is the same either way.
+    """
+    if not chunksize:
+        merged_df = load_market(market_folder)
+        if merged_df is None:
+            return None
+        features_df, labels = prepare_data(merged_df)
+        matrix = features_df.astype(np.float32)
+        matrix['label'] = labels
+        return matrix
+
+    # Read as float32, like load_market does for training
+    blocks = []
+    for block in iter_featurized_blocks(market_folder, chunksize, csv_dtypes(MARKET_DATA_DTYPES, "float32"),
+                                        csv_dtypes(TRADE_DATA_DTYPES, "float32")):
+        matrix = block[features.FEATURE_COLUMNS].astype(np.float32)
+        matrix['label'] = block['label'].astype(str)
+        blocks.append(matrix)
+    return pd.concat(blocks, ignore_index=True) if blocks else None
+
+def market_training_data(period, market, market_folder, chunksize=None):
+    """
+    Features (float32) and labels of one market folder, computed once per version of its
+    files and then read back as memory-mapped columns. Returns None without data.
+    """
+    fingerprint = feature_cache.source_fingerprint(market_folder)
+    entry_dir = os.path.join(TRAINING_CACHE_DIR, str(period), str(market))
+    cached = feature_cache.read_disk_entry(entry_dir, fingerprint)
+    if cached is None:
+        cached = training_matrix(market_folder, chunksize)
+        if cached is None:
+            return None
+        feature_cache.write_disk_entry(entry_dir, fingerprint, cached)
+        cached = feature_cache.read_disk_entry(entry_dir, fingerprint)
+    return fingerprint, cached
+
+def _training_data_task(task):
+    period, market, market_folder, chunksize = task
+    return period, market, market_training_data(period, market, market_folder, chunksize)
+
+def load_training_matrices(base_data_folder="TrainingData", max_workers=None, trained=None, chunksize=None):
+    """
+    Cached features and labels of every market folder, built in a process pool when missing.
+    Returns [(period, market, fingerprint, frame)]. Folders listed in trained, a map of
+    "period/market" to fingerprint, are left out while their files are unchanged.
+    """
+    trained = trained or {}
+    tasks = [(period, market, market_folder, chunksize) for period, market, market_folder in market_folders(base_data_folder)
+             if trained.get(f"{period}/{market}") != feature_cache.source_fingerprint(market_folder)]
+    matrices = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for period, market, result in executor.map(_training_data_task, tasks):
+            if result is None:
+                print(f"No market or trade data files found for {market} in {period}.")
+                continue
+            matrices.append((period, market, *result))
+    return matrices
+
+def stack_matrices(matrices):
+    X = np.concatenate([np.column_stack([frame[column].to_numpy() for column in features.FEATURE_COLUMNS]) for _, _, _, frame in matrices])
+    y = np.concatenate([frame['label'].to_numpy() for _, _, _, frame in matrices]).astype(str)
+    return pd.DataFrame(X, columns=features.FEATURE_COLUMNS), y
+
+def train_from_cache(base_data_folder="TrainingData", output_folder="ModelOutput", n_jobs=-1, cv_splits=5,
+                     incremental=False, new_trees=20, max_workers=None, chunksize=None):
+    """
+    Train the model from the cached per-market feature matrices.
+    The full mode cross-validates with the folds in parallel and fits every tree on all data.
+    The incremental mode keeps the saved forest and grows new_trees trees with warm_start on
+    the market folders it has not seen, so retraining costs about as much as the new data.
+    With a chunksize, market folders are featurized in blocks of that many rows to bound memory.
+    Prints the time spent in each stage and returns the model.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = os.path.join(output_folder, TRAINING_MANIFEST)
+    timings = {}
+
+    model = None
+    trained = {}
+    class_counts = {}
+    if incremental:
+        try:
+            features.check_schema(features.load_schema(output_folder))
+            with open(os.path.join(output_folder, 'trained_model.pkl'), 'rb') as model_file:
+                model = pickle.load(model_file)
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+            trained, class_counts = manifest['markets'], manifest['class_counts']
+        except (OSError, ValueError, KeyError) as e:
+            print(f"No previous model to extend ({e}), training from scratch.")
+            model, trained, class_counts = None, {}, {}
+
+    with timed_stage(timings, 'features'):
+        new_matrices = load_training_matrices(base_data_folder, max_workers, trained, chunksize)
+    if not new_matrices:
+        print("No new data to train on.")
+        return model
+
+    with timed_stage(timings, 'stack'):
+        X_train, y_train = stack_matrices(new_matrices)  # Every market folder unless extending a model
+
+    # warm_start refits the classes on the new data alone, so the new folders must hold
+    # exactly the classes of the saved forest; otherwise retrain on everything
+    if model is not None and not np.array_equal(np.unique(y_train), model.classes_):
+        print(f"New data has classes {list(np.unique(y_train))}, the saved model {list(model.classes_)}; training from scratch.")
+        model, trained, class_counts = None, {}, {}
+        with timed_stage(timings, 'features'):
+            new_matrices = load_training_matrices(base_data_folder, max_workers, chunksize=chunksize)
+        with timed_stage(timings, 'stack'):
+            X_train, y_train = stack_matrices(new_matrices)
+
+    labels, counts = np.unique(y_train, return_counts=True)
+    for label, count in zip(labels, counts):
+        class_counts[str(label)] = class_counts.get(str(label), 0) + int(count)
+
+    if model is None:
+        model = default_model(n_jobs)
+        with timed_stage(timings, 'cross_validation'):
+            cross_validate(model, X_train, y_train, cv_splits, n_jobs)
+    else:
+        # Grow the existing forest: the new trees see only the new data, weighted by the
+        # class balance of everything trained on so far rather than of the new data alone
+        total = sum(class_counts.values())
+        class_weight = {label: total / (len(class_counts) * count) for label, count in class_counts.items()}
+        model.set_params(warm_start=True, n_estimators=len(model.estimators_) + new_trees, n_jobs=n_jobs, class_weight=class_weight)
+        print(f"Adding {new_trees} trees for {len(new_matrices)} new market folders ({len(X_train)} rows).")
+
+    # A failed fit may leave the forest partly grown, so nothing is saved after one
+    try:
+        with timed_stage(timings, 'fit'):
+            model.fit(X_train, y_train)
+            model.set_params(warm_start=False)
+    except Exception as e:
+        print(f"Training failed, the saved model is left unchanged: {e}")
+        return None
+
+    with timed_stage(timings, 'save'):
+        save_model(model, output_folder)
+        trained.update({f"{period}/{market}": fingerprint for period, market, fingerprint, _ in new_matrices})
+        with open(manifest_path, 'w') as manifest_file:
+            json.dump({'markets': trained, 'class_counts': class_counts, 'n_estimators': len(model.estimators_)}, manifest_file, indent=2)
+
+    print_timings(timings)
+    return model
+
 # Main execution
-model = RandomForestClassifier(random_state=42) # Model creation
-
-base_data_folder = "TrainingData"
-merged_df_all_periods = pd.DataFrame()  # Initialize an empty DataFrame to hold all the combined data
-timestamp_format = "%H:%M:%S.%f"
-
-# Loop through all periods and markets dynamically to accumulate data
-for period in os.listdir(base_data_folder):
-    period_folder = os.path.join(base_data_folder, period)
-    
-    if os.path.isdir(period_folder):  # Check if it is a valid period folder
-        for market in os.listdir(period_folder):
-            market_folder = os.path.join(period_folder, market)
-            
-            if os.path.isdir(market_folder):  # Check if it's a valid market folder
-                # Get all relevant market data files
-                market_data_files = [file for file in os.listdir(market_folder) if "market_data" in file and file.endswith(".csv")]
-                
-                if not market_data_files:
-                    print(f"No market data files found for {market} in {period}")
-                    continue  # Skip this market folder if no files found
-
-                # Load and process data if files exist
-                bid_ask_data = pd.concat([pd.read_csv(os.path.join(market_folder, file)) for file in market_data_files], ignore_index=True)
-                
-                # Get trade data files
-                trade_data_files = [file for file in os.listdir(market_folder) if "trade_data" in file and file.endswith(".csv")]
-                if trade_data_files:
-                    price_volume_data = pd.read_csv(os.path.join(market_folder, trade_data_files[0]))
-
-                    # Prepare dataframes
-                    bid_ask_df = pd.DataFrame(bid_ask_data, columns=["bidVolume", "bidPrice", "askVolume", "askPrice", "timestamp"])
-                    price_volume_df = pd.DataFrame(price_volume_data, columns=["price", "volume", "timestamp"])
-
-                    # Process timestamps and clean data
-                    bid_ask_df['timestamp'] = pd.to_datetime(bid_ask_df['timestamp'], format=timestamp_format, errors='coerce')
-                    price_volume_df['timestamp'] = pd.to_datetime(price_volume_df['timestamp'], format=timestamp_format, errors='coerce')
-                    bid_ask_df = bid_ask_df.dropna(subset=['timestamp'])
-                    price_volume_df = price_volume_df.dropna(subset=['timestamp'])
-
-                    # Sort data by timestamp
-                    bid_ask_df = bid_ask_df.sort_values('timestamp')
-                    price_volume_df = price_volume_df.sort_values('timestamp')
-
-                    # Merge dataframes based on timestamp
-                    merged_df = pd.merge_asof(price_volume_df, bid_ask_df, on='timestamp', direction='backward')
-                    # Accumulate the data from all periods and markets
-                    merged_df_all_periods = pd.concat([merged_df_all_periods, merged_df], ignore_index=True)
-                    
-                    print(f"Processed data for {market} in {period}.")
-                else:
-                    print(f"No trade data files found for {market} in {period}.")
-
-# Now train the model on the combined data from all periods and markets
-output_folder = "ModelOutput"  # You can define where the model output should be saved
-train_and_evaluate_with_cv(merged_df_all_periods, model, output_folder)
-
-print("Training completed with data from all periods and markets.")
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Train the model on every period and market of TrainingData.")
+    parser.add_argument('--data', default="TrainingData")
+    parser.add_argument('--output', default="ModelOutput")
+    parser.add_argument('--incremental', action='store_true', help="Add trees for new market folders instead of retraining")
+    parser.add_argument('--new-trees', type=int, default=20, help="Trees added per incremental run")
+    parser.add_argument('--jobs', type=int, default=-1, help="Cores used for the folds and the trees")
+    parser.add_argument('--cv', type=int, default=5, help="Number of cross-validation folds")
+    parser.add_argument('--chunksize', type=int, default=None, help="Featurize each market in blocks of this many rows to bound memory")
+    args = parser.parse_args()
+
+    train_from_cache(args.data, args.output, args.jobs, args.cv, args.incremental, args.new_trees, chunksize=args.chunksize)
+
+    print("Training completed with data from all periods and markets.")
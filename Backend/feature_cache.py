@@ -0,0 +1,135 @@
+import os
+import json
+import shutil
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from features import FEATURE_SCHEMA_VERSION
+
+# Folder holding the raw market data, and the folder the featurized frames are cached in
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_ROOT = "TrainingData"
+CACHE_DIR = os.path.join(BASE_DIR, 'FeatureCache')
+
+# Version of the cached frames' layout, dtypes and arithmetic; bump it to invalidate every entry
+CACHE_FORMAT_VERSION = 4
+
+# Maximum number of featurized frames kept in memory at once
+MEMORY_CACHE_SIZE = 8
+
+_memory_cache = OrderedDict()  # (period, market) -> (fingerprint, DataFrame), least recently used first
+_memory_lock = threading.Lock()
+_build_locks = {}
+
+def source_fingerprint(data_dir):
+    """
+    Describe the CSV files of a market directory by path, size and modification time.
+    Any change to one of the files, to the feature schema or to the cache format gives a
+    different fingerprint.
+    """
+    fingerprint = []
+    for file in sorted(os.listdir(data_dir)):
+        if file.endswith(".csv") and ("market_data" in file or "trade_data" in file):
+            stat = os.stat(os.path.join(data_dir, file))
+            fingerprint.append([file, stat.st_size, stat.st_mtime_ns])
+    # Cached features are stale too once their definition changes
+    fingerprint.append(['feature_schema', FEATURE_SCHEMA_VERSION])
+    fingerprint.append(['cache_format', CACHE_FORMAT_VERSION])
+    return fingerprint
+
+def _entry_dir(market, period):
+    return os.path.join(CACHE_DIR, f"Period{period}", str(market))
+
+def read_disk_entry(entry_dir, fingerprint):
+    """
+    Load a cached frame from disk as memory-mapped columns, or None if it is missing or stale.
+    """
+    manifest_path = os.path.join(entry_dir, 'manifest.json')
+    try:
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get('fingerprint') != fingerprint:
+        return None
+
+    columns = {}
+    for index, column in enumerate(manifest['columns']):
+        columns[column] = np.load(os.path.join(entry_dir, f"{index}.npy"), mmap_mode='r')
+    return pd.DataFrame(columns, copy=False)
+
+def write_disk_entry(entry_dir, fingerprint, df):
+    """
+    Store a frame as one .npy file per column plus a manifest holding the source fingerprint.
+    The entry is written to a temporary folder first so readers never see a partial entry.
+    """
+    tmp_dir = f"{entry_dir}.tmp{os.getpid()}.{threading.get_ident()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    for index, column in enumerate(df.columns):
+        values = df[column].to_numpy()
+        if values.dtype == object:
+            values = values.astype(str)  # Labels and other strings are stored as fixed-width unicode
+        np.save(os.path.join(tmp_dir, f"{index}.npy"), values)
+
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as manifest_file:
+        json.dump({'fingerprint': fingerprint, 'columns': [str(column) for column in df.columns]}, manifest_file)
+
+    # Replace the stale entry, if any, with the new one
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(tmp_dir, entry_dir)
+
+def _remember(key, fingerprint, df):
+    with _memory_lock:
+        _memory_cache[key] = (fingerprint, df)
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
+def get_features(market, period, build):
+    """
+    Return the merged, featurized frame of a market, building it with build(market, period) only
+    when neither the memory cache nor the disk cache holds an entry for the current source files.
+    """
+    key = (str(period), str(market))
+    data_dir = os.path.join(DATA_ROOT, f"Period{period}", str(market))
+    fingerprint = source_fingerprint(data_dir)
+
+    with _memory_lock:
+        cached = _memory_cache.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            _memory_cache.move_to_end(key)
+            return cached[1].copy(deep=False)
+        build_lock = _build_locks.setdefault(key, threading.Lock())
+
+    # Only one thread builds a given market, the others wait and reuse its result
+    with build_lock:
+        with _memory_lock:
+            cached = _memory_cache.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1].copy(deep=False)
+
+        entry_dir = _entry_dir(market, period)
+        df = read_disk_entry(entry_dir, fingerprint)
+        if df is None:
+            df = build(market, period)
+            try:
+                write_disk_entry(entry_dir, fingerprint, df)
+                df = read_disk_entry(entry_dir, fingerprint)
+            except Exception as e:
+                print(f"Failed to cache features for {market} in period {period}: {e}")
+
+        _remember(key, fingerprint, df)
+        return df.copy(deep=False)
+
+def clear_cache(memory_only=False):
+    """
+    Drop every cached frame from memory and, unless memory_only is set, from disk.
+    """
+    with _memory_lock:
+        _memory_cache.clear()
+    if not memory_only:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
@@ -0,0 +1,130 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+# Declared feature schema: bump the version whenever a feature, its definition or the labels change
+FEATURE_SCHEMA_VERSION = 2
+FEATURE_COLUMNS = ['smoothed_price', 'spread', 'momentum', 'volume_ratio', 'avg_price_per_second']
+LABELS = ['Buy', 'Sell', 'Hold']
+SMOOTHING_WINDOW = 10
+
+# File the schema is saved to next to a model
+SCHEMA_FILE = 'feature_schema.json'
+
+class SchemaMismatchError(ValueError):
+    pass
+
+def feature_schema():
+    return {
+        'version': FEATURE_SCHEMA_VERSION,
+        'features': list(FEATURE_COLUMNS),
+        'labels': list(LABELS),
+        'smoothing_window': SMOOTHING_WINDOW,
+    }
+
+def rolling_mean(values, window=SMOOTHING_WINDOW, history=()):
+    """
+    Mean of every value with the window - 1 values before it, NaN values left out. history
+    holds the values that came before the first one, when the values continue a longer series.
+    Each window is summed on its own, oldest value first with Neumaier compensation, so a
+    mean depends on its window alone: a series computed in blocks, each given the last
+    window - 1 values of the one before, gets exactly the means of the whole series.
+    A window of identical values has that value as its mean.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    history = np.asarray(history, dtype=np.float64)[max(0, len(history) - (window - 1)):]
+    padded = np.concatenate((np.full(window - 1 - len(history), np.nan), history, values))
+
+    n = len(values)
+    total = np.zeros(n)
+    compensation = np.zeros(n)
+    count = np.zeros(n, dtype=np.int64)
+    low = np.full(n, np.inf)
+    high = np.full(n, -np.inf)
+    for offset in range(window):
+        value = padded[offset:offset + n]
+        low = np.fmin(low, value)
+        high = np.fmax(high, value)
+        present = ~np.isnan(value)
+        count += present
+        value = np.where(present, value, 0.0)
+        summed = total + value
+        compensation += np.where(np.abs(total) >= np.abs(value), (total - summed) + value, (value - summed) + total)
+        total = summed
+
+    with np.errstate(invalid='ignore'):
+        means = (total + compensation) / count
+    return np.where(low == high, low, means)
+
+def add_features(merged_df, window=SMOOTHING_WINDOW):
+    """
+    Add the model features to a merged, time-sorted trade frame, with column operations only.
+    """
+    price = merged_df['price']
+    merged_df['smoothed_price'] = rolling_mean(price, window)
+    merged_df['spread'] = merged_df['askPrice'] - merged_df['bidPrice']
+    merged_df['momentum'] = merged_df['smoothed_price'] - merged_df['smoothed_price'].shift(1)
+    merged_df['volume_ratio'] = merged_df['bidVolume'] / (merged_df['askVolume'] + 1e-6)
+
+    # Average price over all the trades that happened in the same second. This is the
+    # actualPriceAvg of the trade's 1s bar in bar_aggregator; a groupby gives the same value
+    # for a whole frame at once, where folding every tick through the aggregator would not
+    timestamp_second = merged_df['timestamp'].dt.floor('s')
+    merged_df['avg_price_per_second'] = price.groupby(timestamp_second).transform('mean')
+    return merged_df
+
+def label_codes(momentum, volume_ratio):
+    """
+    Index into LABELS of every row's action: Buy when momentum and order book both point up,
+    Sell when both point down, else Hold. NaN momentum gives Hold.
+    """
+    momentum = np.asarray(momentum, dtype=float)
+    volume_ratio = np.asarray(volume_ratio, dtype=float)
+    codes = np.full(len(momentum), LABELS.index("Hold"), dtype=np.int8)
+    codes[(momentum > 0) & (volume_ratio > 1)] = LABELS.index("Buy")
+    codes[(momentum < 0) & (volume_ratio < 1)] = LABELS.index("Sell")
+    return codes
+
+def label_actions(momentum, volume_ratio):
+    """
+    The actions of label_codes as a Categorical, so every row is decided in one pass over
+    small integer codes and the label strings are only materialized when read.
+    """
+    return pd.Categorical.from_codes(label_codes(momentum, volume_ratio), LABELS)
+
+def add_labels(merged_df):
+    merged_df['label'] = label_actions(merged_df['momentum'], merged_df['volume_ratio'])
+    return merged_df
+
+def featurize(merged_df, window=SMOOTHING_WINDOW):
+    """
+    Features and labels of a merged trade frame, the single definition used for training,
+    serving and evaluation.
+    """
+    return add_labels(add_features(merged_df, window))
+
+def save_schema(model_dir, schema=None):
+    os.makedirs(model_dir, exist_ok=True)
+    with open(os.path.join(model_dir, SCHEMA_FILE), 'w') as schema_file:
+        json.dump(schema or feature_schema(), schema_file, indent=2)
+
+def load_schema(model_dir):
+    """
+    The schema saved next to a model, or None if the model has none.
+    """
+    try:
+        with open(os.path.join(model_dir, SCHEMA_FILE)) as schema_file:
+            return json.load(schema_file)
+    except OSError:
+        return None
+
+def check_schema(schema):
+    """
+    Raise SchemaMismatchError unless a model's schema is the one this code computes.
+    """
+    expected = feature_schema()
+    if schema is None:
+        raise SchemaMismatchError(f"Model has no feature schema, expected version {expected['version']}; retrain it")
+    if schema != expected:
+        raise SchemaMismatchError(f"Model was trained on feature schema {schema}, this code computes {expected}; retrain it")
@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import numpy as np
+
+# Node arrays of a compiled forest, one .npy file each
+NODE_ARRAYS = ['feature', 'threshold', 'children_left', 'children_right', 'missing_go_to_left', 'value']
+
+# Batches up to this many rows walk all the trees at once instead of tree by tree
+SMALL_BATCH_ROWS = 4096
+
+def export_forest(model, output_dir, feature_schema=None):
+    """
+    Compile a fitted RandomForestClassifier into flat node arrays, concatenated over all trees,
+    and save them as memory-mappable .npy files with a small JSON header.
+    Child indices are global, so a node index alone locates a node in any tree.
+    feature_schema, when given, is stored in the header for the loader to check.
+    """
+    features, thresholds, lefts, rights, missing_lefts, values, roots = [], [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        left = tree.children_left.astype(np.int32)
+        right = tree.children_right.astype(np.int32)
+        is_leaf = left == -1
+
+        roots.append(offset)
+        features.append(np.where(is_leaf, -1, tree.feature).astype(np.int32))
+        thresholds.append(tree.threshold.astype(np.float64))
+        lefts.append(np.where(is_leaf, -1, left + offset).astype(np.int32))
+        rights.append(np.where(is_leaf, -1, right + offset).astype(np.int32))
+        missing_lefts.append(tree.missing_go_to_left.astype(bool))
+
+        # Class distribution of every node, normalized the way DecisionTreeClassifier.predict_proba does
+        value = tree.value[:, 0, :].astype(np.float64)
+        normalizer = value.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+        values.append(value / normalizer)
+
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    os.makedirs(output_dir, exist_ok=True)
+    arrays = {
+        'feature': np.concatenate(features),
+        'threshold': np.concatenate(thresholds),
+        'children_left': np.concatenate(lefts),
+        'children_right': np.concatenate(rights),
+        'missing_go_to_left': np.concatenate(missing_lefts),
+        'value': np.concatenate(values),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(output_dir, f"{name}.npy"), array)
+    np.save(os.path.join(output_dir, 'roots.npy'), np.array(roots, dtype=np.int32))
+
+    header = {
+        'classes': [str(label) for label in model.classes_],
+        'feature_names': [str(name) for name in getattr(model, 'feature_names_in_', [])],
+        'n_features': int(model.n_features_in_),
+        'n_trees': len(model.estimators_),
+        'max_depth': int(max_depth),
+        'feature_schema': feature_schema,
+    }
+    with open(os.path.join(output_dir, 'forest.json'), 'w') as header_file:
+        json.dump(header, header_file)
+
+class CompiledForest:
+    """
+    Pure NumPy inference for a forest exported with export_forest. Each tree is walked
+    one level per step for a whole batch of rows at once.
+    """
+
+    def __init__(self, model_dir, mmap_mode='r'):
+        with open(os.path.join(model_dir, 'forest.json')) as header_file:
+            header = json.load(header_file)
+
+        self.classes_ = np.array(header['classes'], dtype=object)
+        self.feature_names_in_ = header['feature_names'] or None
+        self.n_features_in_ = header['n_features']
+        self.n_trees = header['n_trees']
+        self.max_depth = header['max_depth']
+        self.feature_schema = header.get('feature_schema')
+
+        for name in NODE_ARRAYS + ['roots']:
+            setattr(self, name, np.load(os.path.join(model_dir, f"{name}.npy"), mmap_mode=mmap_mode))
+        self._build_traversal_arrays()
+
+    def _build_traversal_arrays(self):
+        """
+        Derive the arrays the batch walk uses, so one step is a handful of gathers:
+        - leaves point to themselves and compare against +inf, so finished rows stay put
+        - float32 thresholds rounded down, so comparing float32 inputs gives the same
+          result as comparing them against the float64 thresholds
+        - both children of a node side by side, indexed by 2 * node + goes_right
+        """
+        is_leaf = np.asarray(self.feature) < 0
+        node_ids = np.arange(len(is_leaf), dtype=np.int32)
+
+        threshold = np.asarray(self.threshold)
+        threshold32 = threshold.astype(np.float32)
+        rounded_up = threshold32.astype(np.float64) > threshold
+        threshold32[rounded_up] = np.nextafter(threshold32[rounded_up], np.float32(-np.inf))
+
+        self._feature = np.where(is_leaf, 0, self.feature).astype(np.intp)
+        self._threshold = np.where(is_leaf, np.float32(np.inf), threshold32).astype(np.float32)
+        self._missing_left = np.where(is_leaf, True, self.missing_go_to_left)
+        self._children = np.empty(2 * len(is_leaf), dtype=np.intp)
+        self._children[0::2] = np.where(is_leaf, node_ids, self.children_left)
+        self._children[1::2] = np.where(is_leaf, node_ids, self.children_right)
+
+    def _as_matrix(self, X):
+        if self.feature_names_in_ is not None and hasattr(X, 'columns'):
+            X = X[self.feature_names_in_]
+        X = np.asarray(X, dtype=np.float32)  # Trees compare float32 inputs, like sklearn does
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected {self.n_features_in_} features, got {X.shape[1]}")
+        return X
+
+    def apply(self, X):
+        """
+        Leaf node index reached by every row in every tree, shape (n_trees, n_rows).
+        """
+        X = self._as_matrix(X)
+        n_rows = X.shape[0]
+        flat_X = X.ravel()
+        row_offsets = np.arange(n_rows, dtype=np.intp) * X.shape[1]
+        has_missing = bool(np.isnan(flat_X).any())
+
+        # Small batches walk all the trees together to keep the number of NumPy calls low
+        if n_rows <= SMALL_BATCH_ROWS:
+            nodes = np.repeat(np.asarray(self.roots, dtype=np.intp)[:, np.newaxis], n_rows, axis=1)
+            return self._walk(flat_X, row_offsets, nodes, has_missing)
+
+        # Large batches go one tree at a time so the working arrays stay in cache
+        leaves = np.empty((self.n_trees, n_rows), dtype=np.intp)
+        for tree_index, root in enumerate(self.roots):
+            nodes = np.full(n_rows, root, dtype=np.intp)
+            leaves[tree_index] = self._walk(flat_X, row_offsets, nodes, has_missing)
+        return leaves
+
+    def _walk(self, flat_X, row_offsets, nodes, has_missing):
+        for _ in range(self.max_depth):
+            x = np.take(flat_X, row_offsets + np.take(self._feature, nodes))
+            goes_right = x > np.take(self._threshold, nodes)
+            if has_missing:
+                goes_right = np.where(np.isnan(x), ~np.take(self._missing_left, nodes), goes_right)
+            nodes = np.take(self._children, 2 * nodes + goes_right)
+        return nodes
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+        proba = np.zeros((leaves.shape[1], len(self.classes_)), dtype=np.float64)
+        for tree_leaves in leaves:  # Summed tree by tree, in the same order as sklearn
+            proba += self.value[tree_leaves]
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+if __name__ == '__main__':
+    # Compile an existing pickled model: python forest_engine.py <model.pkl> <output_dir>
+    import pickle
+    with open(sys.argv[1], 'rb') as model_file:
+        model = pickle.load(model_file)
+    export_forest(model, sys.argv[2])
+    print(f"Compiled forest saved to {sys.argv[2]}")
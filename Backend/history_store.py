@@ -0,0 +1,171 @@
+import os
+import math
+import threading
+import datetime
+import numpy as np
+import pandas as pd
+import feature_cache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+HISTORY_DIR = os.path.join(BASE_DIR, 'HistoryStore')
+
+# Downsampling levels, finest first, with their bar length in seconds
+RESOLUTIONS = {'1s': 1, '10s': 10, '1m': 60, '5m': 300}
+
+# Upper bound on the number of points a query returns
+DEFAULT_MAX_POINTS = 1000
+
+# Columns of every bar in the pyramids
+BAR_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume', 'trades', 'bidPrice', 'askPrice']
+
+NANOS_PER_SECOND = 1_000_000_000
+
+def aggregate_bars(bars, group_starts, timestamps):
+    """
+    Fold consecutive bars into coarser ones; group_starts are the index of the first bar of
+    each group and timestamps the start time of each group.
+    """
+    return pd.DataFrame({
+        'timestamp': timestamps,
+        'open': bars['open'].to_numpy()[group_starts],
+        'high': np.maximum.reduceat(bars['high'].to_numpy(), group_starts),
+        'low': np.minimum.reduceat(bars['low'].to_numpy(), group_starts),
+        'close': bars['close'].to_numpy()[np.append(group_starts[1:], len(bars)) - 1],
+        'volume': np.add.reduceat(bars['volume'].to_numpy(), group_starts),
+        'trades': np.add.reduceat(bars['trades'].to_numpy(), group_starts),
+        'bidPrice': bars['bidPrice'].to_numpy()[np.append(group_starts[1:], len(bars)) - 1],
+        'askPrice': bars['askPrice'].to_numpy()[np.append(group_starts[1:], len(bars)) - 1],
+    })
+
+def build_pyramid(merged_df):
+    """
+    OHLC and volume bars of the trades at every resolution. The 1s bars are built from the
+    ticks and every coarser level from the level below it. Intervals without trades have no bar.
+    """
+    ticks = pd.DataFrame({
+        'timestamp': merged_df['timestamp'].to_numpy().astype('datetime64[ns]').view(np.int64),
+        'open': merged_df['price'].to_numpy(dtype=float),
+        'volume': merged_df['volume'].to_numpy(dtype=float),
+        'trades': np.ones(len(merged_df), dtype=np.int64),
+        'bidPrice': merged_df['bidPrice'].to_numpy(dtype=float),
+        'askPrice': merged_df['askPrice'].to_numpy(dtype=float),
+    })
+    ticks['high'] = ticks['low'] = ticks['close'] = ticks['open']
+
+    pyramid = {}
+    bars = ticks
+    for resolution, seconds in RESOLUTIONS.items():
+        if bars.empty:
+            pyramid[resolution] = pd.DataFrame({column: [] for column in BAR_COLUMNS})
+            continue
+        bucket = bars['timestamp'].to_numpy() // (seconds * NANOS_PER_SECOND)
+        group_starts = np.flatnonzero(np.diff(bucket, prepend=bucket[0] - 1))
+        bars = aggregate_bars(bars, group_starts, bucket[group_starts] * seconds * NANOS_PER_SECOND)
+        pyramid[resolution] = bars[BAR_COLUMNS]
+    return pyramid
+
+def _as_nanos(bound, day):
+    """
+    Convert a time bound (datetime.time or timestamp) into epoch nanoseconds; a time of day
+    is taken on the day the data starts.
+    """
+    if isinstance(bound, datetime.time):
+        bound = pd.Timestamp.combine(day, bound)
+    return pd.Timestamp(bound).value
+
+class HistoryStore:
+    """
+    Historical ticks and bars of one market, held as timestamp-sorted memory-mapped columns.
+    Range queries binary search the timestamps, and long ranges are answered from the
+    coarsest pyramid level that still gives enough detail.
+    """
+
+    def __init__(self, ticks, pyramid):
+        self.ticks = ticks
+        self.pyramid = pyramid
+        self.tick_times = ticks['timestamp'].to_numpy().astype('datetime64[ns]').view(np.int64)
+        self.bar_times = {resolution: bars['timestamp'].to_numpy().astype(np.int64) for resolution, bars in pyramid.items()}
+
+    def time_range(self, start=None, end=None):
+        """
+        Epoch nanosecond bounds of a query; missing bounds extend to the ends of the data.
+        """
+        if not len(self.tick_times):
+            return 0, -1
+        day = pd.Timestamp(self.tick_times[0]).normalize()
+        start = self.tick_times[0] if start is None else _as_nanos(start, day)
+        end = self.tick_times[-1] if end is None else _as_nanos(end, day)
+        return start, end
+
+    def _slice(self, times, start, end):
+        return np.searchsorted(times, start, side='left'), np.searchsorted(times, end, side='right')
+
+    def query(self, start=None, end=None, resolution='auto', max_points=DEFAULT_MAX_POINTS):
+        """
+        Rows between start and end, inclusive, at most max_points of them.
+        resolution is 'raw' for ticks, one of RESOLUTIONS, or 'auto' for the finest level
+        that fits. Levels that still hold too many bars are merged further, so the bound
+        always holds. Returns (resolution, frame).
+        """
+        if resolution not in ('auto', 'raw') and resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution {resolution}, expected auto, raw or one of {tuple(RESOLUTIONS)}")
+        max_points = max(1, int(max_points))
+        start, end = self.time_range(start, end)
+
+        if resolution in ('auto', 'raw'):
+            first, last = self._slice(self.tick_times, start, end)
+            if resolution == 'raw' or last - first <= max_points:
+                return 'raw', self.ticks.iloc[first:min(last, first + max_points)]
+
+        # A bar is included when its interval overlaps the window, so round start down to it
+        levels = list(RESOLUTIONS) if resolution == 'auto' else [resolution]
+        for level in levels:
+            bar_length = RESOLUTIONS[level] * NANOS_PER_SECOND
+            first, last = self._slice(self.bar_times[level], start - start % bar_length, end)
+            if last - first <= max_points:
+                return level, self.pyramid[level].iloc[first:last]
+
+        # Even the coarsest level is too dense: merge runs of consecutive bars
+        bars = self.pyramid[level].iloc[first:last]
+        if bars.empty:
+            return level, bars
+        seconds = RESOLUTIONS[level] * math.ceil((last - first) / max_points)
+        while True:
+            bucket = bars['timestamp'].to_numpy() // (seconds * NANOS_PER_SECOND)
+            group_starts = np.flatnonzero(np.diff(bucket, prepend=bucket[0] - 1))
+            if len(group_starts) <= max_points:
+                return f"{seconds}s", aggregate_bars(bars, group_starts, bucket[group_starts] * seconds * NANOS_PER_SECOND)
+            seconds *= 2  # Bucket edges split some runs, widen until the bound holds
+
+_stores = {}  # (period, market) -> (fingerprint, HistoryStore)
+_stores_lock = threading.Lock()
+
+def _pyramid_dir(market, period, resolution):
+    return os.path.join(HISTORY_DIR, f"Period{period}", str(market), resolution)
+
+def get_store(market, period, build):
+    """
+    The history store of a market. Ticks come from the feature cache, and the pyramids are
+    built once per version of the source files and kept on disk next to it.
+    """
+    key = (str(period), str(market))
+    fingerprint = feature_cache.source_fingerprint(os.path.join(feature_cache.DATA_ROOT, f"Period{period}", str(market)))
+    with _stores_lock:
+        cached = _stores.get(key)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    ticks = feature_cache.get_features(market, period, build)
+    pyramid = {resolution: feature_cache.read_disk_entry(_pyramid_dir(market, period, resolution), fingerprint) for resolution in RESOLUTIONS}
+    if any(bars is None for bars in pyramid.values()):
+        pyramid = build_pyramid(ticks)
+        try:
+            for resolution, bars in pyramid.items():
+                feature_cache.write_disk_entry(_pyramid_dir(market, period, resolution), fingerprint, bars)
+        except Exception as e:
+            print(f"Failed to save the history of {market} in period {period}: {e}")
+
+    store = HistoryStore(ticks, pyramid)
+    with _stores_lock:
+        _stores[key] = (fingerprint, store)
+    return store
@@ -1,11 +1,22 @@
 import os
+import json
 import pandas as pd
 import pickle  # For loading the trained model
-from flask import Flask
+from flask import Flask, Response, request
 from flask_sock import Sock
 from threading import Thread
-import time
 import numpy as np
+import feature_cache
+import history_store
+import bar_aggregator
+import replay
+import wire_format
+import metrics
+import features
+from chunked_ingest import load_market
+from forest_engine import CompiledForest
+from subscriptions import Subscription, parse_list, parse_time_bound
+from broadcast import BroadcastHub, DEFAULT_QUEUE_SIZE, DEFAULT_OVERFLOW
 # Initialize Flask app and Flask-Sock
 app = Flask(__name__)
 sock = Sock(app)
@@ -17,10 +28,19 @@ DATA_DIR = os.path.join(BASE_DIR, 'TrainingData/Period2')
 # Path to the pre-trained machine learning model
 MODEL_PATH = os.path.join(BASE_DIR, 'ModelOutput/trained_model.pkl')
 
-# Load the pre-trained model
+# Compiled form of the same model, exported by the training pipeline and loaded without sklearn
+COMPILED_MODEL_DIR = os.path.join(BASE_DIR, 'ModelOutput/compiled_forest')
+
+# Load the pre-trained model, preferring the compiled forest, and refuse it unless it was
+# trained on the features this code computes
 try:
-    with open(MODEL_PATH, 'rb') as model_file:
-        model = pickle.load(model_file)
+    if os.path.isdir(COMPILED_MODEL_DIR):
+        model = CompiledForest(COMPILED_MODEL_DIR)
+        features.check_schema(model.feature_schema)
+    else:
+        features.check_schema(features.load_schema(os.path.dirname(MODEL_PATH)))
+        with open(MODEL_PATH, 'rb') as model_file:
+            model = pickle.load(model_file)
     print("Model loaded successfully.")
 except Exception as e:
     print(f"Failed to load model: {e}")
@@ -33,6 +53,9 @@ COLUMN_MAPPINGS = {
     # Add more mappings as needed for other column counts
 }
 
+# Number of rows scored per model.predict call when predicting a whole market
+PREDICT_BLOCK_SIZE = 4096
+
 def get_column_names(num_columns):
     """
     Get column names based on the number of columns in the data.
@@ -41,134 +64,307 @@ def get_column_names(num_columns):
 
 def preprocess_and_label_data(market, period):
     data_dir = f"TrainingData/Period{str(period)}/{market}/"
-    
-    all_files = os.listdir(data_dir)
-    
-    market_data_files = [file for file in all_files if "market_data" in file and file.endswith(".csv")]
-    trade_data_files = [file for file in all_files if "trade_data" in file and file.endswith(".csv")]
-    
-    bid_ask_data = pd.concat([pd.read_csv(os.path.join(data_dir, file)) for file in market_data_files], ignore_index=True)
-    price_volume_data = pd.read_csv(os.path.join(data_dir, trade_data_files[0]))
-    
-    bid_ask_df = pd.DataFrame(bid_ask_data, columns=["bidVolume", "bidPrice", "askVolume", "askPrice", "timestamp"])
-    price_volume_df = pd.DataFrame(price_volume_data, columns=["price", "volume", "timestamp"])
-
-    bid_ask_df['timestamp'] = pd.to_datetime(bid_ask_df['timestamp'], errors='coerce')
-    price_volume_df['timestamp'] = pd.to_datetime(price_volume_df['timestamp'], errors='coerce')
-
-    bid_ask_df = bid_ask_df.dropna(subset=['timestamp'])
-    price_volume_df = price_volume_df.dropna(subset=['timestamp'])
-
-    bid_ask_df = bid_ask_df.sort_values('timestamp')
-    price_volume_df = price_volume_df.sort_values('timestamp')
-
-    merged_df = pd.merge_asof(price_volume_df, bid_ask_df, on='timestamp', direction='backward')
-
-    merged_df['smoothed_price'] = merged_df['price'].rolling(window=10, min_periods=1).mean()
-    merged_df['spread'] = merged_df['askPrice'] - merged_df['bidPrice']
-    merged_df['momentum'] = merged_df['smoothed_price'] - merged_df['smoothed_price'].shift(1)
-    merged_df['volume_ratio'] = merged_df['bidVolume'] / (merged_df['askVolume'] + 1e-6)
-
-    def label_entry(row):
-        if row['momentum'] > 0 and row['volume_ratio'] > 1:
-            return "Buy"
-        elif row['momentum'] < 0 and row['volume_ratio'] < 1:
-            return "Sell"
-        else:
-            return "Hold"
 
-    merged_df['label'] = merged_df.apply(label_entry, axis=1)
+    # Same loader and feature definitions as the training pipeline, in float64 so the prices
+    # sent to clients are the ones in the files and stay on the tick grid for delta encoding
+    merged_df = load_market(data_dir, float_dtype="float64")
+    if merged_df is None:
+        raise ValueError(f"No market or trade data in {data_dir}")
+
+    with metrics.timed('features'):
+        return features.featurize(merged_df)
+
+def predict_actions(merged_df, block_size=PREDICT_BLOCK_SIZE):
+    """
+    Predict the action (hold, buy, or sell) for every row of a featurized market frame.
+    The model is called once per block of rows instead of once per row.
+    """
+    if not model:
+        return ["unknown"] * len(merged_df)  # Default action if the model isn't loaded
+
+    features_df = merged_df[features.FEATURE_COLUMNS]
+    actions = []
+
+    for start in range(0, len(features_df), block_size):
+        block = features_df.iloc[start:start + block_size]
+        try:
+            with metrics.timed('predict'):
+                prediction = model.predict(block)
+            actions.extend(str(value) for value in prediction)
+        except Exception as e:
+            metrics.ERRORS.inc('predict')
+            print(f"Prediction error: {e}")
+            actions.extend(["error"] * len(block))  # In case of unexpected prediction error
 
-    return merged_df
+    return actions
 
 def predict_action(row):
     """
     Predict the action (hold, buy, or sell) for a given row.
     """
-    if model:
-        try:
-            # Convert row to DataFrame (if it's a pandas Series)
-            row_df = pd.DataFrame([row]) 
+    row_df = pd.DataFrame([row])
 
-            # Feature engineering
-            row_df['spread'] = row_df['askPrice'] - row_df['bidPrice']
+    # Fill in features the row may be missing when it did not come from preprocess_and_label_data.
+    # A lone row has no second around it, so its own price stands in for avg_price_per_second
+    if 'spread' not in row_df:
+        row_df['spread'] = row_df['askPrice'] - row_df['bidPrice']
+    if 'volume_ratio' not in row_df:
+        row_df['volume_ratio'] = row_df['bidVolume'] / (row_df['askVolume'] + 1e-6)
+    if 'avg_price_per_second' not in row_df:
+        row_df['avg_price_per_second'] = row_df['price']
 
-            row_df['volume_ratio'] = row_df['bidVolume'] / (row_df['askVolume'] + 1e-6)
-            
-            # Calculate average price for a given second
-            row_df['timestamp_second'] = row_df['timestamp'].dt.floor('s')  # Round down timestamp to the nearest second
-            avg_price_per_second = row_df.groupby('timestamp_second')['price'].mean().reset_index(name='avg_price_per_second')
-            
-            # Merge the average price back into the row
-            row_df = pd.merge(row_df, avg_price_per_second, on='timestamp_second', how='left')
+    return predict_actions(row_df)[0]
 
-            # Ensure all required features are present
-            required_features = ['smoothed_price', 'spread', 'momentum', 'volume_ratio', 'avg_price_per_second']
-            features = row_df[required_features].values.reshape(1, -1)
 
-            # Convert features to DataFrame to ensure feature names match the model
-            features_df = pd.DataFrame(features, columns=required_features)
+def market_messages(market_name, block_size=PREDICT_BLOCK_SIZE):
+    """
+    Produce the rows of a market directory, with their predicted action, ready to be streamed.
+    Rows are predicted and converted one block at a time as the stream reaches them, so the
+    first rows go out without waiting for the whole market and a stream that stops early
+    leaves the rest of the market unpredicted.
+    """
+    metrics.debug(1, f"Reading market: {market_name}")
 
-            # Get the model's prediction (e.g., 0, 1, or 2)
-            prediction = model.predict(features_df)
-            result = str(prediction[0])
-            print(f"Raw model prediction: {result}")  # Debugging the raw prediction
+    # Read and merge the CSV files, reusing the cached frame when the files have not changed
+    merged_df = feature_cache.get_features(market_name, 2, preprocess_and_label_data)
 
-            return result
+    for start in range(0, len(merged_df), block_size):
+        block = merged_df.iloc[start:start + block_size]
+        rows = block.assign(action=predict_actions(block, block_size), market=market_name).to_dict('records')
+        if metrics.DEBUG_LEVEL < 2:
+            yield from rows
+            continue
 
-        except Exception as e:
-            print(f"Prediction error: {e}")
-            return "error"  # In case of unexpected prediction error
+        for row_dict in rows:
+            print(f"Sending data: {row_dict}")  # Debugging: print the data being sent
+            yield row_dict
 
-    else:
-        return "unknown"  # Default action if the model isn't loaded
+def list_markets(data_dir=None):
+    """
+    Markets available for streaming: the sub-directories of the Period2 directory, or of
+    another period's directory when one is given.
+    """
+    if data_dir is None:
+        data_dir = DATA_DIR  # Read at call time, so DATA_DIR can be pointed elsewhere
+    if not os.path.isdir(data_dir):
+        return []
+    return sorted(market for market in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, market)))
 
+def period_dir(period):
+    """
+    Directory of a period, next to the Period2 directory.
+    """
+    return os.path.join(os.path.dirname(DATA_DIR), f"Period{period}")
 
-def stream_file(sock, file_path, market_name):
+def replay_messages(channel):
     """
-    Function to stream the rows (entries) from each file in a market directory.
+    Replay the subscribed markets in one global event-time order at the speed and offset of
+    the channel. Markets nobody subscribed to are never read or predicted.
     """
-    try:
-        print(f"Reading file: {file_path}")
+    speed, start_offset = channel
+    events = replay.merge_subscribed_markets(market_messages, lambda: hub.wanted_markets(channel))
+    return replay.schedule(events, speed, start_offset)
 
-        # Read and merge the CSV files as before
-        merged_df = preprocess_and_label_data(market_name, period=2)
+# One producer per replay setting, shared by every client that asked for it
+hub = BroadcastHub(replay_messages)
 
-        # Predict and stream each row as a JSON object with a 1-second delay
-        for _, row in merged_df.iterrows():
-            row_dict = row.to_dict()  # Convert row to dictionary
-            row_dict['action'] = predict_action(row)  # Add the predicted action
-            row_dict['market'] = market_name
-            print(f"Sending data: {row_dict}")  # Debugging: print the data being sent
-            sock.send(row_dict)  # Send data through WebSocket
-            time.sleep(1)  # Delay for 1 second between sending each row
+def all_subscribers():
+    return hub.subscribers() + bar_hub.subscribers()
 
-    except Exception as e:
-        sock.send({"status": "error", "message": f"Error processing file {file_path}: {str(e)}"})
+# Client gauges over the /stream and /bars hubs, read when /metrics is scraped
+metrics.REGISTRY.gauge('mchacks_connected_clients', 'WebSocket clients currently streaming.', lambda: len(all_subscribers()))
+metrics.REGISTRY.gauge('mchacks_client_queue_depth', 'Messages waiting in each client queue.',
+                       lambda: {(subscriber.client_id,): subscriber.qsize() for subscriber in all_subscribers()}, ['client'])
+metrics.REGISTRY.gauge('mchacks_client_dropped_messages', 'Messages dropped for each client by its overflow policy.',
+                       lambda: {(subscriber.client_id,): subscriber.dropped for subscriber in all_subscribers()}, ['client'])
+
+def read_control_messages(sock, subscriber):
+    """
+    Apply the client's control messages to its subscription until the socket closes.
+    Replies go through the client's queue so the streaming loop stays the only writer.
+    """
+    while True:
+        try:
+            data = sock.receive()
+        except Exception:
+            break  # Connection closed
+        if data is None:
+            continue
+
+        try:
+            subscriber.subscription.apply(json.loads(data), list_markets())
+            reply = {"status": "subscribed", "subscription": subscriber.subscription.to_dict()}
+        except Exception as e:
+            reply = {"status": "error", "message": f"Invalid control message: {str(e)}"}
+        subscriber.put(None, reply)
+
+    subscriber.close()
+
+def send_messages(sock, items, wire, fields, delta):
+    """
+    Write queued (market, message) pairs to the socket in the client's wire format.
+    Returns True once the end-of-stream marker has been reached.
+    """
+    if wire == 'rows':
+        with metrics.timed('socket_send'):
+            for market, message in items:
+                if message is None:
+                    return True
+                sock.send(wire_format.encode_row(message, fields if market is not None else None))
+                if market is not None:
+                    metrics.ROWS_SENT.inc(wire)
+        return False
+
+    # Columnar micro-batches, one message per market
+    batches = {}
+    done = False
+    for market, message in items:
+        if message is None:
+            done = True
+            break
+        if market is None:
+            sock.send(wire_format.encode_message(message))  # Status messages are sent as is
+        else:
+            batches.setdefault(market, []).append(message)
+
+    with metrics.timed('socket_send'):
+        for market, rows in batches.items():
+            sock.send(wire_format.encode_batch(market, rows, fields, delta))
+            metrics.ROWS_SENT.inc(wire, amount=len(rows))
+    return done
 
 # Route to stream file entries through WebSocket
 @sock.route('/stream')
 def stream(sock):
+    subscriber = None
     try:
-        print("WebSocket connection established")
-        threads = []
+        metrics.debug(1, "WebSocket connection established")
+
+        # Replay speed multiplier (1, 10, ... or max) and offset in seconds from the start of the data
+        speed = replay.parse_speed(request.args.get('speed'))
+        start_offset = request.args.get('start', 0.0, type=float)
+
+        # Wire format: plain per-row JSON by default, or columnar micro-batches per market
+        wire = request.args.get('format', wire_format.DEFAULT_WIRE_FORMAT)
+        if wire not in wire_format.WIRE_FORMATS:
+            raise ValueError(f"Unknown format {wire}, expected one of {wire_format.WIRE_FORMATS}")
+        batch_size = request.args.get('batch', wire_format.DEFAULT_BATCH_SIZE, type=int) if wire == 'columnar' else 1
+        delta = request.args.get('delta', '').lower() in ('1', 'true', 'yes')
+
+        queue_size = request.args.get('queue_size', DEFAULT_QUEUE_SIZE, type=int)
+        overflow = request.args.get('overflow', DEFAULT_OVERFLOW)
 
-        # Iterate over all sub-directories in the Period2 directory
-        for market in os.listdir(DATA_DIR):
-            market_path = os.path.join(DATA_DIR, market)
-            if os.path.isdir(market_path):
-                thread = Thread(target=stream_file, args=(sock, market_path, market))
-                thread.start()
-                threads.append(thread)
+        # Markets, fields, actions and time window the client watches; it can change them later
+        subscription = Subscription.from_params(request.args, list_markets())
+        subscriber = hub.subscribe((speed, start_offset), subscription, queue_size, overflow)
+        Thread(target=read_control_messages, args=(sock, subscriber), daemon=True).start()
 
-        # Wait for all threads to complete
-        for thread in threads:
-            thread.join()
+        # This loop is the only writer to the socket, so sends from different markets never interleave
+        while True:
+            items = subscriber.get_many(max(1, batch_size))
+            if not items:
+                if subscriber.disconnected:
+                    sock.send(wire_format.encode_message({"status": "error", "message": "Client fell too far behind and was disconnected."}))
+                return
 
-        sock.send({"status": "complete", "message": "All file entries have been streamed."})
+            if send_messages(sock, items, wire, subscription.fields, delta):
+                break
+
+        sock.send(wire_format.encode_message({"status": "complete", "message": "All file entries have been streamed."}))
 
     except Exception as e:
-        sock.send({"status": "error", "message": str(e)})
+        metrics.ERRORS.inc('stream')
+        sock.send(wire_format.encode_message({"status": "error", "message": str(e)}))
+
+    finally:
+        if subscriber is not None:
+            hub.unsubscribe(subscriber)
+
+def bar_messages(market_name, interval):
+    """
+    Bars of a market in the streamed_data.json schema, built from its quotes and trades as they close.
+    """
+    for _, bar in bar_aggregator.market_bars(os.path.join(DATA_DIR, market_name), (interval,)):
+        bar['market'] = market_name
+        bar['interval'] = interval
+        yield bar
+
+def replay_bar_messages(channel):
+    """
+    Replay the bars of the subscribed markets, like replay_messages does for rows.
+    """
+    speed, start_offset, interval = channel
+    events = replay.merge_subscribed_markets(lambda market: bar_messages(market, interval), lambda: bar_hub.wanted_markets(channel))
+    return replay.schedule(events, speed, start_offset)
+
+# One bar producer per replay setting and interval, shared by every /bars client that asked for it
+bar_hub = BroadcastHub(replay_bar_messages)
+
+# Route to stream per-interval bars of the chosen markets, replayed like /stream
+@sock.route('/bars')
+def bars(sock):
+    subscriber = None
+    try:
+        speed = replay.parse_speed(request.args.get('speed'))
+        start_offset = request.args.get('start', 0.0, type=float)
+        interval = request.args.get('interval', bar_aggregator.DEFAULT_INTERVALS[0], type=int)
+        if interval <= 0:
+            raise ValueError(f"Bar interval must be a positive number of seconds, got {interval}")
+
+        subscription = Subscription.from_params({'markets': request.args.get('markets')}, list_markets())
+        subscriber = bar_hub.subscribe((speed, start_offset, interval), subscription,
+                                       request.args.get('queue_size', DEFAULT_QUEUE_SIZE, type=int),
+                                       request.args.get('overflow', DEFAULT_OVERFLOW))
+
+        while True:
+            items = subscriber.get_many(wire_format.DEFAULT_BATCH_SIZE)
+            if not items:
+                if subscriber.disconnected:
+                    sock.send(wire_format.encode_message({"status": "error", "message": "Client fell too far behind and was disconnected."}))
+                return
+
+            for market, message in items:
+                if message is None:
+                    sock.send(wire_format.encode_message({"status": "complete", "message": "All bars have been streamed."}))
+                    return
+                sock.send(wire_format.encode_message(bar_aggregator.format_bar(message) if market is not None else message))
+
+    except Exception as e:
+        metrics.ERRORS.inc('bars')
+        sock.send(wire_format.encode_message({"status": "error", "message": str(e)}))
+
+    finally:
+        if subscriber is not None:
+            bar_hub.unsubscribe(subscriber)
+
+# Past ticks or bars of one market in a time window, with a bounded number of points
+@app.route('/history')
+def history():
+    try:
+        market = request.args.get('market')
+        period = request.args.get('period', 2, type=int)
+        if market not in list_markets(period_dir(period)):
+            return {"status": "error", "message": f"Unknown market {market} in period {period}"}, 404
+        max_points = min(request.args.get('max_points', history_store.DEFAULT_MAX_POINTS, type=int), history_store.DEFAULT_MAX_POINTS * 10)
+
+        store = history_store.get_store(market, period, preprocess_and_label_data)
+        resolution, frame = store.query(parse_time_bound(request.args.get('from')), parse_time_bound(request.args.get('to')),
+                                        request.args.get('resolution', 'auto'), max_points)
+        fields, columns = wire_format.frame_columns(frame, parse_list(request.args.get('fields')))
+    except Exception as e:
+        return {"status": "error", "message": str(e)}, 400
+
+    return {"type": "history", "market": market, "resolution": resolution, "count": len(frame), "fields": fields, "columns": columns}
+
+# Prometheus scrape endpoint
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--debug-level', type=int, default=metrics.DEBUG_LEVEL,
+                        help="0: no debug output, 1: connections and markets, 2: every streamed row")
+    metrics.set_debug_level(parser.parse_args().debug_level)
     app.run(host='127.0.0.1', port=5000, debug=True)
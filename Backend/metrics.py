@@ -0,0 +1,165 @@
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, from 10 microseconds to 10 seconds
+DEFAULT_BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+# Debug printing: 0 is off, 1 prints per market events, 2 also prints every streamed row
+DEBUG_LEVEL = int(os.environ.get('DEBUG_LEVEL', 0))
+
+def set_debug_level(level):
+    global DEBUG_LEVEL
+    DEBUG_LEVEL = int(level)
+
+def debug(level, message):
+    """
+    Print message when the debug level is at least level. message may be a callable so that
+    expensive formatting is skipped entirely when the level is off.
+    """
+    if DEBUG_LEVEL >= level:
+        print(message() if callable(message) else message)
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+class Counter:
+    """
+    Monotonic count, optionally split by label values.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [(self.name, label_values, None, value) for label_values, value in values]
+
+class Gauge:
+    """
+    Value read when /metrics is scraped. function returns either a number, or a dict mapping
+    tuples of label values to numbers.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, function, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.function = function
+
+    def samples(self):
+        value = self.function()
+        if not isinstance(value, dict):
+            return [(self.name, (), None, value)]
+        return [(self.name, label_values, None, sample) for label_values, sample in value.items()]
+
+class Histogram:
+    """
+    Fixed-bucket histogram of durations. An observation is one bisect and two additions,
+    so it is cheap enough for the per-block hot paths.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, *label_values, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 3)
+            series[index] += 1  # The last bucket slot before sum and count is +Inf
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*label_values, value=time.perf_counter() - start)
+
+    def samples(self):
+        with self._lock:
+            series = {label_values: list(values) for label_values, values in self._series.items()}
+
+        samples = []
+        for label_values, values in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                bucket = '+Inf' if bound == float('inf') else repr(bound)
+                samples.append((f'{self.name}_bucket', label_values, {'le': bucket}, cumulative))
+            samples.append((f'{self.name}_sum', label_values, None, values[-2]))
+            samples.append((f'{self.name}_count', label_values, None, values[-1]))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, function, labels=()):
+        return self.register(Gauge(name, help, function, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, label_values, extra, value in metric.samples():
+                lines.append(f'{name}{_format_labels(metric.labels, label_values, extra)} {value}')
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+# Time spent in each stage of the streaming pipeline
+STAGE_SECONDS = REGISTRY.histogram('mchacks_stage_seconds', 'Time spent in each pipeline stage, in seconds.', ['stage'])
+
+# Rows written to clients and errors by where they happened
+ROWS_SENT = REGISTRY.counter('mchacks_rows_sent_total', 'Rows sent to WebSocket clients.', ['format'])
+ERRORS = REGISTRY.counter('mchacks_errors_total', 'Errors by where they happened.', ['stage'])
+
+def timed(stage):
+    """
+    Record the duration of a with block under the given pipeline stage.
+    """
+    return STAGE_SECONDS.time(stage)
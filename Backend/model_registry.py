@@ -0,0 +1,175 @@
+import os
+import json
+import uuid
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REGISTRY_DIR = os.path.join(BASE_DIR, 'ModelRegistry')
+
+# Total size of the pickled models kept in memory at once
+MEMORY_BUDGET_BYTES = 512 * 1024 * 1024
+
+def model_name(key):
+    market, period, version = key
+    return f"{market}_Period{period}_v{version}"
+
+class ModelRegistry:
+    """
+    Fitted models keyed by (market, period, feature set version). Models are persisted to
+    disk with the fingerprint of the data they were trained on, and the recently used ones
+    are kept in memory up to a budget in bytes, least recently used evicted first.
+    """
+
+    def __init__(self, registry_dir=REGISTRY_DIR, memory_budget=MEMORY_BUDGET_BYTES):
+        self.registry_dir = registry_dir
+        self.memory_budget = memory_budget
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (metadata, model, size)
+        self._memory_bytes = 0
+
+    def _paths(self, key):
+        base = os.path.join(self.registry_dir, model_name(key))
+        return f"{base}.pkl", f"{base}.json"
+
+    def save(self, key, model, metadata):
+        """
+        Write a fitted model and its metadata; the files are renamed into place so a reader
+        never sees a partial model.
+        """
+        os.makedirs(self.registry_dir, exist_ok=True)
+        model_path, metadata_path = self._paths(key)
+        for path, write in ((model_path, lambda file: pickle.dump(model, file)),
+                            (metadata_path, lambda file: file.write(json.dumps(metadata).encode()))):
+            tmp_path = f"{path}.tmp{os.getpid()}"
+            with open(tmp_path, 'wb') as file:
+                write(file)
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            self._forget(key)
+
+    def get(self, key, fingerprint=None):
+        """
+        Return (metadata, model) for key, or None when no model was trained for it or when
+        the data it was trained on has changed since.
+        """
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                self._memory.move_to_end(key)
+
+        # Models are saved by worker processes, so a stale model in memory may have been
+        # replaced on disk: reload it when the saved metadata matches the data
+        if cached is not None and fingerprint is not None and cached[0].get('fingerprint') != fingerprint:
+            metadata = self._read_metadata(key)
+            if metadata is None or metadata.get('fingerprint') != fingerprint:
+                return None
+            self.forget(key)
+            cached = None
+
+        if cached is None:
+            cached = self._load(key)
+            if cached is None:
+                return None
+
+        metadata, model, _ = cached
+        if fingerprint is not None and metadata.get('fingerprint') != fingerprint:
+            return None
+        return metadata, model
+
+    def _read_metadata(self, key):
+        try:
+            with open(self._paths(key)[1]) as metadata_file:
+                return json.load(metadata_file)
+        except (OSError, ValueError):
+            return None
+
+    def _load(self, key):
+        model_path, metadata_path = self._paths(key)
+        try:
+            with open(metadata_path) as metadata_file:
+                metadata = json.load(metadata_file)
+            with open(model_path, 'rb') as model_file:
+                model = pickle.load(model_file)
+        except (OSError, ValueError, pickle.UnpicklingError):
+            return None
+
+        cached = (metadata, model, os.path.getsize(model_path))
+        with self._lock:
+            self._forget(key)
+            self._memory[key] = cached
+            self._memory_bytes += cached[2]
+            # Always keep the model just loaded, even if it alone exceeds the budget
+            while self._memory_bytes > self.memory_budget and len(self._memory) > 1:
+                _, (_, _, size) = self._memory.popitem(last=False)
+                self._memory_bytes -= size
+        return cached
+
+    def forget(self, key):
+        """
+        Drop the in-memory copy of a model, so the next get reads it from disk.
+        """
+        with self._lock:
+            self._forget(key)
+
+    def _forget(self, key):
+        cached = self._memory.pop(key, None)
+        if cached is not None:
+            self._memory_bytes -= cached[2]
+
+    def memory_usage(self):
+        with self._lock:
+            return {'models': len(self._memory), 'bytes': self._memory_bytes, 'budget': self.memory_budget}
+
+class TrainingJobs:
+    """
+    Runs training functions in a process pool so the web server keeps answering while a
+    model is being fitted. Submitting a key that is already being trained returns the
+    running job instead of starting a second one. When a job finishes, its key is dropped
+    from the registry's memory so the model it saved is read from disk.
+    """
+
+    def __init__(self, max_workers=None, registry=None):
+        self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        self._registry = registry
+        self._lock = threading.Lock()
+        self._jobs = {}  # job id -> job dict
+        self._running = {}  # key -> job id
+
+    def submit(self, key, function, *args):
+        with self._lock:
+            if key in self._running:
+                return self._jobs[self._running[key]]
+
+            job = {'id': uuid.uuid4().hex, 'key': list(key), 'status': 'pending', 'result': None, 'error': None}
+            self._jobs[job['id']] = job
+            self._running[key] = job['id']
+
+        job['status'] = 'running'
+        future = self._executor.submit(function, *args)
+        future.add_done_callback(lambda future: self._finish(key, job, future))
+        return job
+
+    def _finish(self, key, job, future):
+        try:
+            job['result'] = future.result()
+            job['status'] = 'done'
+        except Exception as e:
+            job['error'] = str(e)
+            job['status'] = 'failed'
+        if self._registry is not None:
+            self._registry.forget(key)
+        with self._lock:
+            self._running.pop(key, None)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -6,6 +6,10 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report
 from flask import Flask, request, jsonify
 from flask_socketio import SocketIO, emit
+import features
+from chunked_ingest import load_market
+from feature_cache import source_fingerprint
+from model_registry import ModelRegistry, TrainingJobs
 
 app = Flask(__name__)
 socketio = SocketIO(app)
@@ -13,65 +17,153 @@ socketio = SocketIO(app)
 markets = ["A", "B", "C", "D", "E"]
 period = 2  # default period, can be updated via API
 
-# Function to preprocess and label data
-def preprocess_and_label_data(market, period):
-    data_dir = f"TrainingData/Period{str(period)}/{market}/"
-    
-    all_files = os.listdir(data_dir)
-    
-    market_data_files = [file for file in all_files if "market_data" in file and file.endswith(".csv")]
-    trade_data_files = [file for file in all_files if "trade_data" in file and file.endswith(".csv")]
-    
-    bid_ask_data = pd.concat([pd.read_csv(os.path.join(data_dir, file)) for file in market_data_files], ignore_index=True)
-    price_volume_data = pd.read_csv(os.path.join(data_dir, trade_data_files[0]))
-    
-    bid_ask_df = pd.DataFrame(bid_ask_data, columns=["bidVolume", "bidPrice", "askVolume", "askPrice", "timestamp"])
-    price_volume_df = pd.DataFrame(price_volume_data, columns=["price", "volume", "timestamp"])
-
-    bid_ask_df['timestamp'] = pd.to_datetime(bid_ask_df['timestamp'], errors='coerce')
-    price_volume_df['timestamp'] = pd.to_datetime(price_volume_df['timestamp'], errors='coerce')
-
-    bid_ask_df = bid_ask_df.dropna(subset=['timestamp'])
-    price_volume_df = price_volume_df.dropna(subset=['timestamp'])
+# Features the models of this module are trained on, from the shared schema
+FEATURE_COLUMNS = features.FEATURE_COLUMNS
+FEATURE_SET_VERSION = features.FEATURE_SCHEMA_VERSION
 
-    bid_ask_df = bid_ask_df.sort_values('timestamp')
-    price_volume_df = price_volume_df.sort_values('timestamp')
+LABEL_CODES = {"Buy": 0, "Sell": 1, "Hold": 2}
+LABEL_NAMES = {code: label for label, code in LABEL_CODES.items()}
 
-    merged_df = pd.merge_asof(price_volume_df, bid_ask_df, on='timestamp', direction='backward')
+# Fitted models by (market, period, feature set version), and the background training jobs
+registry = ModelRegistry()
+jobs = None  # Process pool created on the first training request
 
-    merged_df['smoothed_price'] = merged_df['price'].rolling(window=10, min_periods=1).mean()
-    merged_df['spread'] = merged_df['askPrice'] - merged_df['bidPrice']
-    merged_df['momentum'] = merged_df['smoothed_price'] - merged_df['smoothed_price'].shift(1)
-    merged_df['volume_ratio'] = merged_df['bidVolume'] / (merged_df['askVolume'] + 1e-6)
+def model_key(market, period):
+    return (str(market), int(period), FEATURE_SET_VERSION)
 
-    def label_entry(row):
-        if row['momentum'] > 0 and row['volume_ratio'] > 1:
-            return "Buy"
-        elif row['momentum'] < 0 and row['volume_ratio'] < 1:
-            return "Sell"
-        else:
-            return "Hold"
+def market_dir(market, period):
+    return f"TrainingData/Period{str(period)}/{market}/"
 
-    merged_df['label'] = merged_df.apply(label_entry, axis=1)
-
-    return merged_df
+# Function to preprocess and label data, with the loader and features the other services share
+def preprocess_and_label_data(market, period):
+    data_dir = market_dir(market, period)
+    merged_df = load_market(data_dir)
+    if merged_df is None:
+        raise ValueError(f"No market or trade data in {data_dir}")
+    return features.featurize(merged_df)
 
-# Function to train or test the model
-def train_or_test_model(market, period, mode="train"):
+def train_model(market, period):
+    """
+    Fit a model for one market and period, evaluate it on the held out split and save both
+    to the registry. Runs in a worker process when submitted as a training job.
+    """
+    fingerprint = source_fingerprint(market_dir(market, period))
     merged_df = preprocess_and_label_data(market, period)
     
-    features = merged_df[['spread', 'momentum', 'volume_ratio']]
+    features_df = merged_df[FEATURE_COLUMNS]
     labels = merged_df['label']
     
-    labels_encoded = labels.map({"Buy": 0, "Sell": 1, "Hold": 2}).values
+    labels_encoded = labels.map(LABEL_CODES).values
 
-    X_train, X_test, y_train, y_test = train_test_split(features, labels_encoded, test_size=0.2, random_state=42)
+    X_train, X_test, y_train, y_test = train_test_split(features_df, labels_encoded, test_size=0.2, random_state=42)
 
     model = RandomForestClassifier()
+    model.fit(X_train, y_train)
+    y_pred = model.predict(X_test)
+
+    metadata = {
+        'market': str(market),
+        'period': int(period),
+        'feature_set_version': FEATURE_SET_VERSION,
+        'features': FEATURE_COLUMNS,
+        'feature_schema': features.feature_schema(),
+        'fingerprint': fingerprint,
+        'train_rows': len(X_train),
+        'test_rows': len(X_test),
+        'report': classification_report(y_test, y_pred, labels=list(LABEL_NAMES), target_names=list(LABEL_CODES), zero_division=0),
+    }
+    registry.save(model_key(market, period), model, metadata)
+    return metadata
+
+def get_model(market, period):
+    """
+    The registered (metadata, model) for a market and period, or None if it still has to be
+    trained or its data changed since it was trained.
+    """
+    data_dir = market_dir(market, period)
+    fingerprint = source_fingerprint(data_dir) if os.path.isdir(data_dir) else None
+    return registry.get(model_key(market, period), fingerprint)
 
+def submit_training(market, period, force=False):
+    """
+    Start a background training job unless an up to date model is already registered.
+    """
+    global jobs
+    if not force and get_model(market, period) is not None:
+        return None
+    if jobs is None:
+        jobs = TrainingJobs(registry=registry)
+    return jobs.submit(model_key(market, period), train_model, market, period)
+
+# Function to train or test the model
+def train_or_test_model(market, period, mode="train"):
     if mode == "train":
-        model.fit(X_train, y_train)
+        train_model(market, period)
         return f"Model trained for market {market}, period {period}"
     elif mode == "test":
-        y_pred = model.predict(X_test)
-        return classification_report(y_test, y_pred)
+        registered = get_model(market, period)
+        metadata = registered[0] if registered is not None else train_model(market, period)
+        return metadata['report']
+
+def request_market_period():
+    params = request.get_json(silent=True) or request.args
+    market = params.get('market')
+    if market not in markets:
+        raise ValueError(f"Unknown market {market}, expected one of {markets}")
+    return market, int(params.get('period', period))
+
+# Start training a model in the background; answers at once if an up to date model exists
+@app.route('/models/train', methods=['POST'])
+def train_endpoint():
+    try:
+        market, market_period = request_market_period()
+        force = str((request.get_json(silent=True) or {}).get('force', request.args.get('force', ''))).lower() in ('1', 'true', 'yes')
+        job = submit_training(market, market_period, force)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if job is None:
+        return jsonify({"status": "cached", "model": get_model(market, market_period)[0]})
+    return jsonify({"status": job['status'], "job": job}), 202
+
+@app.route('/jobs/<job_id>')
+def job_endpoint(job_id):
+    job = jobs.get(job_id) if jobs is not None else None
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job {job_id}"}), 404
+    return jsonify(job)
+
+# Evaluation report of the registered model on its held out split
+@app.route('/models/test')
+def test_endpoint():
+    try:
+        market, market_period = request_market_period()
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    registered = get_model(market, market_period)
+    if registered is None:
+        return jsonify({"status": "error", "message": f"No model trained for market {market}, period {market_period}"}), 404
+    return jsonify({"status": "ok", "report": registered[0]['report'], "model": registered[0]})
+
+# Predict actions for feature rows sent as {"market": ..., "period": ..., "rows": [{...}, ...]}
+@app.route('/models/predict', methods=['POST'])
+def predict_endpoint():
+    try:
+        market, market_period = request_market_period()
+        registered = get_model(market, market_period)
+        if registered is None:
+            return jsonify({"status": "error", "message": f"No model trained for market {market}, period {market_period}"}), 404
+        try:
+            features.check_schema(registered[0].get('feature_schema'))
+        except features.SchemaMismatchError as e:
+            return jsonify({"status": "error", "message": str(e)}), 409
+
+        rows = pd.DataFrame(request.get_json()['rows'], columns=FEATURE_COLUMNS)
+        predictions = registered[1].predict(rows)
+        return jsonify({"status": "ok", "actions": [LABEL_NAMES[int(code)] for code in predictions]})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+if __name__ == '__main__':
+    socketio.run(app, host='127.0.0.1', port=5001, debug=False)
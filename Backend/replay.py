@@ -0,0 +1,109 @@
+import heapq
+import time
+
+DEFAULT_SPEED = 1.0
+MAX_SPEED_VALUES = ('max', '0', '')
+
+# Seconds between checks for a new subscription while no market is wanted
+IDLE_POLL_INTERVAL = 0.05
+
+def parse_speed(value):
+    """
+    Read a replay speed multiplier; "max" (or 0) means as fast as possible and returns None.
+    """
+    if value is None:
+        return DEFAULT_SPEED
+    value = str(value).strip().lower()
+    if value in MAX_SPEED_VALUES:
+        return None
+    speed = float(value.removesuffix('x'))
+    if speed <= 0:
+        raise ValueError(f"Replay speed must be positive or 'max', got {value}")
+    return speed
+
+def _tag_rows(market, rows):
+    for row in rows:
+        yield row['timestamp'], market, row
+
+def merge_markets(streams):
+    """
+    Merge the time-ordered rows of several markets into one global time-ordered stream of
+    (timestamp, market, row). streams maps each market to an iterable of rows with a 'timestamp'.
+    Only the next row of each market is held in the heap.
+    """
+    return heapq.merge(*(_tag_rows(market, rows) for market, rows in streams.items()), key=lambda event: event[0])
+
+def merge_subscribed_markets(open_market, wanted_markets, poll_interval=IDLE_POLL_INTERVAL, sleep=time.sleep):
+    """
+    Like merge_markets, but the set of markets can change while streaming: wanted_markets()
+    is checked before every event, markets nobody wants are dropped, and newly wanted markets
+    are opened with open_market(market) and joined at the current event time.
+    A market that is never wanted is never opened, so none of its rows are computed.
+    While no market is wanted the merge waits for one, so switching markets does not end it.
+    It ends once every wanted market is exhausted, or when wanted_markets() returns None
+    because nobody is listening anymore.
+    """
+    heap = []
+    streams = {}  # market -> iterator of rows, for the markets currently merged
+    sequence = 0  # Breaks timestamp ties in the order rows were pushed
+    current_timestamp = None
+
+    def push_next(market, rows):
+        nonlocal sequence
+        for row in rows:
+            if current_timestamp is None or row['timestamp'] >= current_timestamp:
+                heapq.heappush(heap, (row['timestamp'], sequence, market, row, rows))
+                sequence += 1
+                return
+
+    while True:
+        wanted = wanted_markets()
+        if wanted is None:
+            return
+        for market in sorted(wanted - streams.keys()):
+            streams[market] = iter(open_market(market))
+            push_next(market, streams[market])
+        for market in streams.keys() - wanted:
+            del streams[market]
+
+        if not heap:
+            if wanted:
+                return  # Every wanted market has been streamed to its end
+            sleep(poll_interval)
+            continue
+
+        timestamp, _, market, row, rows = heapq.heappop(heap)
+        if streams.get(market) is not rows:
+            continue  # The market was dropped, or dropped and opened again, since this row was queued
+
+        current_timestamp = timestamp
+        yield timestamp, market, row
+        push_next(market, rows)
+
+def schedule(events, speed=DEFAULT_SPEED, start_offset=0.0, clock=time.monotonic, sleep=time.sleep):
+    """
+    Emit (market, row) pairs from a time-ordered stream of (timestamp, market, row) so that
+    the gap between two emissions is their gap in event time divided by speed.
+    Events in the first start_offset seconds of data are skipped, and a speed of None
+    emits everything without waiting.
+    """
+    first_timestamp = None
+    replay_start = None
+    wall_start = None
+
+    for timestamp, market, row in events:
+        if first_timestamp is None:
+            first_timestamp = timestamp
+        elapsed = (timestamp - first_timestamp).total_seconds()
+        if elapsed < start_offset:
+            continue
+
+        if speed:
+            if wall_start is None:
+                replay_start = elapsed
+                wall_start = clock()
+            delay = (elapsed - replay_start) / speed - (clock() - wall_start)
+            if delay > 0:
+                sleep(delay)
+
+        yield market, row
@@ -0,0 +1,244 @@
+import math
+from collections import deque
+import pandas as pd
+from features import FEATURE_COLUMNS, SMOOTHING_WINDOW
+
+# Columns of a featurized row, in the same order as features.featurize
+QUOTE_COLUMNS = ['bidVolume', 'bidPrice', 'askVolume', 'askPrice']
+TRADE_COLUMNS = ['price', 'volume', 'timestamp']
+OUTPUT_COLUMNS = TRADE_COLUMNS + QUOTE_COLUMNS + FEATURE_COLUMNS + ['label']
+
+# Scalar form of features.label_actions for one tick at a time; keep the two in step
+def label_entry(momentum, volume_ratio):
+    if momentum > 0 and volume_ratio > 1:
+        return "Buy"
+    elif momentum < 0 and volume_ratio < 1:
+        return "Sell"
+    else:
+        return "Hold"
+
+class RollingMean:
+    """
+    Fixed-size rolling mean over a ring buffer, updated in constant time.
+    Mirrors pandas' rolling(window, min_periods).mean(), compensated summation included,
+    so the results are bit-for-bit identical to the batch path.
+    """
+
+    def __init__(self, window, min_periods=1):
+        self.window = window
+        self.min_periods = max(1, min_periods)
+        self.values = [0.0] * window
+        self.position = 0
+        self.count = 0  # Number of values pushed so far, capped at the window size
+
+        self.nobs = 0
+        self.sum = 0.0
+        self.compensation_add = 0.0
+        self.compensation_remove = 0.0
+        self.neg_ct = 0
+        self.consecutive_same = 0
+        self.prev_value = math.nan
+
+    def push(self, value):
+        if self.count == self.window:
+            self._remove(self.values[self.position])
+        else:
+            self.count += 1
+        self.values[self.position] = value
+        self.position = (self.position + 1) % self.window
+        self._add(value)
+        return self.mean()
+
+    def _add(self, value):
+        if value == value:
+            self.nobs += 1
+            y = value - self.compensation_add
+            t = self.sum + y
+            self.compensation_add = t - self.sum - y
+            self.sum = t
+            if math.copysign(1.0, value) < 0:
+                self.neg_ct += 1
+            if value == self.prev_value:
+                self.consecutive_same += 1
+            else:
+                self.consecutive_same = 1
+            self.prev_value = value
+
+    def _remove(self, value):
+        if value == value:
+            self.nobs -= 1
+            y = -value - self.compensation_remove
+            t = self.sum + y
+            self.compensation_remove = t - self.sum - y
+            self.sum = t
+            if math.copysign(1.0, value) < 0:
+                self.neg_ct -= 1
+
+    def mean(self):
+        if self.nobs < self.min_periods:
+            return math.nan
+        if self.consecutive_same >= self.nobs:
+            return self.prev_value
+        result = self.sum / self.nobs
+        if self.neg_ct == 0 and result < 0:
+            return 0.0
+        if self.neg_ct == self.nobs and result > 0:
+            return 0.0
+        return result
+
+class WindowMean:
+    """
+    Scalar form of features.rolling_mean for one value at a time: the mean of the last
+    window values pushed, summed in the same order with the same compensation, so the
+    results are bit-for-bit identical to the batch path.
+    """
+
+    def __init__(self, window):
+        self.values = deque(maxlen=window)
+
+    def push(self, value):
+        self.values.append(value)
+        return self.mean()
+
+    def mean(self):
+        total = 0.0
+        compensation = 0.0
+        count = 0
+        low, high = math.inf, -math.inf
+        for value in self.values:
+            if value != value:
+                continue  # NaN adds nothing, as the zero the batch path adds in its place
+            count += 1
+            low, high = min(low, value), max(high, value)
+            summed = total + value
+            if abs(total) >= abs(value):
+                compensation += (total - summed) + value
+            else:
+                compensation += (value - summed) + total
+            total = summed
+
+        if low == high:
+            return low
+        return (total + compensation) / count if count else math.nan
+
+class CompensatedSum:
+    """
+    Running sum with Kahan compensation, the summation pandas uses for groupby means, so
+    averages built from it match the batch pipeline bit for bit. NaN values are skipped.
+    Shared by the per-second features and the bar aggregator.
+    """
+
+    def __init__(self):
+        self.sum = 0.0
+        self.compensation = 0.0
+        self.count = 0
+
+    def add(self, value):
+        if value == value:
+            y = value - self.compensation
+            t = self.sum + y
+            self.compensation = t - self.sum - y
+            self.sum = t
+            self.count += 1
+
+    def mean(self):
+        return self.sum / self.count if self.count else math.nan
+
+class StreamingFeatureEngine:
+    """
+    Per-market feature state for live ticks. Quotes and trades are fed in time order and
+    each update costs constant time, so no history is ever recomputed.
+
+    The features of a trade are only final once its second has closed, because
+    avg_price_per_second averages every trade of that second. update_trade therefore
+    returns the rows of the previous second when a new second starts, and flush returns
+    the rows of the current one. current_avg_price_per_second gives the running value.
+    """
+
+    def __init__(self, window=SMOOTHING_WINDOW):
+        self.smoothing = WindowMean(window)
+        self.last_quote = dict.fromkeys(QUOTE_COLUMNS, math.nan)  # Replaces the backward merge_asof
+        self.prev_smoothed_price = math.nan
+
+        # Running accumulator of the current second
+        self.current_second = None
+        self.second_prices = CompensatedSum()
+        self.pending_rows = []
+
+    def update_quote(self, quote):
+        """
+        Record the latest bid/ask quote; it applies to every later trade.
+        """
+        for column in QUOTE_COLUMNS:
+            self.last_quote[column] = quote[column]
+
+    def update_trade(self, trade):
+        """
+        Compute the features of a trade against the latest quote.
+        Returns the rows whose second has closed, which may be empty.
+        """
+        price = trade['price']
+        timestamp = pd.Timestamp(trade['timestamp'])
+        second = timestamp.value // 1_000_000_000
+
+        completed = []
+        if self.current_second is not None and second != self.current_second:
+            completed = self.flush()
+        self.current_second = second
+
+        smoothed_price = self.smoothing.push(price)
+        momentum = smoothed_price - self.prev_smoothed_price
+        self.prev_smoothed_price = smoothed_price
+
+        row = {'price': price, 'volume': trade['volume'], 'timestamp': timestamp}
+        row.update(self.last_quote)
+        row['smoothed_price'] = smoothed_price
+        row['spread'] = row['askPrice'] - row['bidPrice']
+        row['momentum'] = momentum
+        row['volume_ratio'] = row['bidVolume'] / (row['askVolume'] + 1e-6)
+        row['label'] = label_entry(momentum, row['volume_ratio'])
+
+        # Accumulate the per-second average with the same compensated sum as pandas' groupby mean
+        self.second_prices.add(price)
+
+        self.pending_rows.append(row)
+        return completed
+
+    def current_avg_price_per_second(self):
+        return self.second_prices.mean()
+
+    def flush(self):
+        """
+        Close the current second and return its rows with their final avg_price_per_second.
+        """
+        avg_price_per_second = self.current_avg_price_per_second()
+        rows = self.pending_rows
+        for row in rows:
+            row['avg_price_per_second'] = avg_price_per_second
+
+        self.pending_rows = []
+        self.second_prices = CompensatedSum()
+        return rows
+
+def feature_vector(row):
+    """
+    Model input for a single featurized row, in the order the model was trained on.
+    """
+    return [row[column] for column in FEATURE_COLUMNS]
+
+def replay(bid_ask_df, price_volume_df, window=SMOOTHING_WINDOW):
+    """
+    Feed sorted quote and trade frames through the engine, quotes first on equal timestamps
+    like merge_asof(direction='backward'), and yield the featurized rows in trade order.
+    """
+    engine = StreamingFeatureEngine(window)
+    quotes = bid_ask_df[QUOTE_COLUMNS + ['timestamp']].to_dict('records')
+    quote_index = 0
+
+    for trade in price_volume_df[TRADE_COLUMNS].to_dict('records'):
+        while quote_index < len(quotes) and quotes[quote_index]['timestamp'] <= trade['timestamp']:
+            engine.update_quote(quotes[quote_index])
+            quote_index += 1
+        yield from engine.update_trade(trade)
+
+    yield from engine.flush()
@@ -0,0 +1,136 @@
+import datetime
+import pandas as pd
+
+# Actions a client can filter on; "trade" is shorthand for Buy and Sell only
+ACTIONS = ('Buy', 'Sell', 'Hold')
+ACTION_ALIASES = {'trade': ('Buy', 'Sell'), 'all': ACTIONS}
+
+def parse_list(value):
+    """
+    Read a list given either as a JSON array or as a comma separated string; empty means None.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    items = [str(item).strip() for item in value if str(item).strip()]
+    return items or None
+
+def parse_actions(value):
+    items = parse_list(value)
+    if items is None:
+        return None
+
+    actions = set()
+    for item in items:
+        if item.lower() in ACTION_ALIASES:
+            actions.update(ACTION_ALIASES[item.lower()])
+        elif item.capitalize() in ACTIONS:
+            actions.add(item.capitalize())
+        else:
+            raise ValueError(f"Unknown action {item}, expected one of {ACTIONS} or {tuple(ACTION_ALIASES)}")
+    return actions
+
+def parse_time_bound(value):
+    """
+    Read a time window bound: a full timestamp, or a time of day such as 10:05:00 that is
+    compared with the time of day of each row.
+    """
+    if value is None or value == '':
+        return None
+    value = str(value).strip()
+    try:
+        return datetime.time.fromisoformat(value)
+    except ValueError:
+        return pd.Timestamp(value)
+
+def _comparable(timestamp, bound):
+    if isinstance(bound, datetime.time):
+        return pd.Timestamp(timestamp).time()
+    return pd.Timestamp(timestamp)
+
+class Subscription:
+    """
+    What a client watches: a set of markets, the fields it renders, an optional time window
+    and an optional set of actions. Only matching rows are queued for the client.
+    """
+
+    def __init__(self, markets, fields=None, actions=None, start=None, end=None):
+        self.markets = set(markets)
+        self.fields = fields
+        self.actions = actions
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def from_params(cls, params, available_markets):
+        """
+        Build a subscription from query parameters or a control message; markets defaults to all.
+        """
+        markets = parse_list(params.get('markets'))
+        subscription = cls(available_markets if markets is None else [])
+        if markets is not None:
+            subscription.add_markets(markets, available_markets)
+        subscription.update(params)
+        return subscription
+
+    def add_markets(self, markets, available_markets):
+        unknown = set(markets) - set(available_markets)
+        if unknown:
+            raise ValueError(f"Unknown markets: {sorted(unknown)}")
+        self.markets = self.markets | set(markets)
+
+    def remove_markets(self, markets):
+        self.markets = self.markets - set(markets)
+
+    def update(self, params):
+        """
+        Replace the filters present in params, leaving the others as they are.
+        """
+        if 'fields' in params:
+            self.fields = parse_list(params['fields'])
+        if 'actions' in params:
+            self.actions = parse_actions(params['actions'])
+        if 'from' in params:
+            self.start = parse_time_bound(params['from'])
+        if 'to' in params:
+            self.end = parse_time_bound(params['to'])
+
+    def apply(self, control, available_markets):
+        """
+        Apply a control message sent by the client while streaming:
+        {"type": "subscribe" | "unsubscribe", "markets": [...]} adds or removes markets, and any
+        of "fields", "actions", "from" and "to" (allowed with every type, or alone with
+        "type": "filter") replaces that filter.
+        """
+        kind = control.get('type', 'filter')
+        markets = parse_list(control.get('markets')) or []
+        if kind == 'subscribe':
+            self.add_markets(markets, available_markets)
+        elif kind == 'unsubscribe':
+            self.remove_markets(markets)
+        elif kind != 'filter':
+            raise ValueError(f"Unknown control message type {kind}")
+        self.update(control)
+
+    def accepts(self, market, message):
+        if market is None:
+            return True  # Status messages always go through
+        if market not in self.markets:
+            return False
+        if self.actions is not None and message.get('action') not in self.actions:
+            return False
+        if self.start is not None and _comparable(message['timestamp'], self.start) < self.start:
+            return False
+        if self.end is not None and _comparable(message['timestamp'], self.end) > self.end:
+            return False
+        return True
+
+    def to_dict(self):
+        return {
+            'markets': sorted(self.markets),
+            'fields': self.fields,
+            'actions': sorted(self.actions) if self.actions is not None else None,
+            'from': str(self.start) if self.start is not None else None,
+            'to': str(self.end) if self.end is not None else None,
+        }
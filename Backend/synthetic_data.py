@@ -0,0 +1,111 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+# Trading session the generated timestamps fall in, in seconds after midnight
+SESSION_START = 10 * 3600
+SESSION_LENGTH = 6 * 3600
+
+PRICE_TICK = 0.01
+
+def format_timestamps(seconds):
+    """
+    Format seconds after midnight as %H:%M:%S.%f, the format of the exchange files.
+    """
+    micros = np.round(seconds * 1_000_000).astype(np.int64)
+    hours, micros = np.divmod(micros, 3_600_000_000)
+    minutes, micros = np.divmod(micros, 60_000_000)
+    secs, micros = np.divmod(micros, 1_000_000)
+    return [f"{h:02d}:{m:02d}:{s:02d}.{u:06d}" for h, m, s, u in zip(hours, minutes, secs, micros)]
+
+def mid_price_path(rng, n, start_price, volatility):
+    steps = rng.normal(0.0, volatility, n)
+    return np.maximum(start_price + np.cumsum(steps), 1.0)
+
+def generate_market(market_folder, rng, n_quotes=50_000, n_trades=20_000, n_quote_files=2, start_price=100.0, volatility=0.01):
+    """
+    Write market_data_*.csv and trade_data.csv files for one market.
+    Quotes follow a random-walk mid price with a spread of one to three ticks, and trades
+    print near the quote in force, so the as-of merge finds realistic pairs.
+    """
+    os.makedirs(market_folder, exist_ok=True)
+    market = os.path.basename(os.path.normpath(market_folder))
+
+    quote_times = np.sort(SESSION_START + rng.uniform(0, SESSION_LENGTH, n_quotes))
+    mid = mid_price_path(rng, n_quotes, start_price, volatility)
+    half_spread = rng.integers(1, 4, n_quotes) * PRICE_TICK / 2
+    quotes = pd.DataFrame({
+        'bidVolume': rng.integers(1, 200, n_quotes),
+        'bidPrice': np.round(mid - half_spread, 2),
+        'askVolume': rng.integers(1, 200, n_quotes),
+        'askPrice': np.round(mid + half_spread, 2),
+        'timestamp': format_timestamps(quote_times),
+    })
+
+    # Split the quotes over several files, each still in time order
+    file_index = rng.integers(0, n_quote_files, n_quotes)
+    for index in range(n_quote_files):
+        quotes[file_index == index].to_csv(os.path.join(market_folder, f"market_data_{market}_{index}.csv"), index=False)
+
+    trade_times = np.sort(SESSION_START + rng.uniform(0, SESSION_LENGTH, n_trades))
+    quote_in_force = np.clip(np.searchsorted(quote_times, trade_times, side='right') - 1, 0, n_quotes - 1)
+    trade_side = rng.choice([-1, 1], n_trades)
+    trades = pd.DataFrame({
+        'price': np.round(mid[quote_in_force] + trade_side * half_spread[quote_in_force], 2),
+        'volume': rng.integers(1, 100, n_trades),
+        'timestamp': format_timestamps(trade_times),
+    })
+    trades.to_csv(os.path.join(market_folder, f"trade_data_{market}.csv"), index=False)
+
+def generate_training_data(root, periods=2, markets=("A", "B", "C", "D", "E"), n_quotes=50_000, n_trades=20_000, n_quote_files=2, seed=42):
+    """
+    Write a TrainingData/Period<n>/<market> tree under root, the layout the backend expects.
+    """
+    rng = np.random.default_rng(seed)
+    for period in range(1, periods + 1):
+        for market in markets:
+            market_folder = os.path.join(root, "TrainingData", f"Period{period}", market)
+            generate_market(market_folder, rng, n_quotes, n_trades, n_quote_files, start_price=rng.uniform(50, 150))
+    return os.path.join(root, "TrainingData")
+
+def generate_bars(n_bars, seed=42, start="2025-01-25 10:00:00"):
+    """
+    Per-second bars with the schema of streamed_data.json.
+    """
+    rng = np.random.default_rng(seed)
+    mid = mid_price_path(rng, n_bars, 117.35, 0.01)
+    half_spread = rng.integers(1, 4, n_bars) * PRICE_TICK / 2
+    quote_counts = rng.integers(1, 15, n_bars)
+    trade_counts = rng.integers(0, 5, n_bars)
+
+    bars = pd.DataFrame({'timestamp': pd.date_range(start, periods=n_bars, freq='s').strftime("%Y-%m-%d %H:%M:%S")})
+    for side, sign in (('ask', 1), ('bid', -1)):
+        price = np.round(mid + sign * half_spread, 2)
+        volume = rng.integers(1, 200, n_bars) * quote_counts
+        bars[f'{side}PriceAvg'] = price
+        bars[f'{side}PriceSum'] = price * quote_counts
+        bars[f'{side}VolumeAvg'] = volume / quote_counts
+        bars[f'{side}VolumeSum'] = volume.astype(float)
+
+    traded = trade_counts > 0
+    actual_volume = rng.integers(1, 100, n_bars) * trade_counts
+    bars['actualPriceAvg'] = np.where(traded, np.round(mid, 2), 0.0)
+    bars['actualPriceSum'] = bars['actualPriceAvg'] * trade_counts
+    bars['actualVolumeAvg'] = np.where(traded, actual_volume / np.maximum(trade_counts, 1), 0.0)
+    bars['actualVolumeSum'] = actual_volume.astype(float)
+    return bars
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic TrainingData tree.")
+    parser.add_argument('root', help="Folder to create TrainingData in")
+    parser.add_argument('--periods', type=int, default=2)
+    parser.add_argument('--markets', default="A,B,C,D,E")
+    parser.add_argument('--quotes', type=int, default=50_000, help="Quotes per market")
+    parser.add_argument('--trades', type=int, default=20_000, help="Trades per market")
+    parser.add_argument('--quote-files', type=int, default=2, help="market_data files per market")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    folder = generate_training_data(args.root, args.periods, args.markets.split(','), args.quotes, args.trades, args.quote_files, args.seed)
+    print(f"Synthetic data written to {folder}")
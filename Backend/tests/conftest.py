@@ -0,0 +1,59 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+# The backend modules are imported by name, as when run from the Backend folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic_data
+from chunked_ingest import QUOTE_COLUMNS, TRADE_COLUMNS, market_files, timestamp_format
+
+@pytest.fixture
+def market_folder(tmp_path):
+    """
+    A small generated market with the awkward cases the batch and incremental paths must
+    agree on: trades before the first quote (NaN quotes and momentum), runs of trades on one
+    timestamp, trades on the timestamp of a quote and seconds with many trades.
+    """
+    folder = str(tmp_path / "Period1" / "A")
+    rng = np.random.default_rng(7)
+    synthetic_data.generate_market(folder, rng, n_quotes=3000, n_trades=2000, n_quote_files=2)
+
+    quotes, trades = read_market(folder)
+    trades.loc[:4, 'timestamp'] = quotes['timestamp'].iloc[0] - pd.Timedelta(seconds=1)
+    trades.loc[40:60, 'timestamp'] = trades.loc[40, 'timestamp']
+    trades.loc[100, 'timestamp'] = quotes['timestamp'].iloc[500]
+    trades = trades.sort_values('timestamp', kind='mergesort')
+    trades['timestamp'] = trades['timestamp'].dt.strftime(timestamp_format)
+
+    trade_file = market_files(folder)[1][0]
+    trades[TRADE_COLUMNS].to_csv(trade_file, index=False)
+    return folder
+
+def read_market(folder):
+    """
+    The quotes and trades of a market folder, parsed and sorted as load_market sorts them.
+    """
+    market_data_files, trade_data_files = market_files(folder)
+    quotes = pd.concat([pd.read_csv(file) for file in market_data_files], ignore_index=True)[QUOTE_COLUMNS]
+    trades = pd.read_csv(trade_data_files[0])[TRADE_COLUMNS]
+    for frame in (quotes, trades):
+        frame['timestamp'] = pd.to_datetime(frame['timestamp'], format=timestamp_format)
+    return (quotes.sort_values('timestamp', kind='mergesort').reset_index(drop=True),
+            trades.sort_values('timestamp', kind='mergesort').reset_index(drop=True))
+
+def assert_frames_identical(expected, actual):
+    """
+    Same columns and bit-for-bit the same values, NaN matching NaN.
+    """
+    assert list(actual.columns) == list(expected.columns)
+    assert len(actual) == len(expected)
+    for column in expected.columns:
+        left = expected[column].to_numpy()
+        right = actual[column].to_numpy()
+        if left.dtype.kind in 'fiM':
+            assert np.array_equal(left, right.astype(left.dtype), equal_nan=(left.dtype.kind == 'f')), column
+        else:
+            assert (left.astype(str) == right.astype(str)).all(), column
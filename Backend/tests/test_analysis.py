@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+import pytest
+import analysis
+import synthetic_data
+
+@pytest.fixture
+def bars():
+    bars = synthetic_data.generate_bars(600, seed=3)
+    # Crossed quotes give SELL decisions, and bars without quoted volume a zero imbalance
+    crossed = bars.index % 17 == 0
+    bars.loc[crossed, ['askPriceAvg', 'bidPriceAvg']] = bars.loc[crossed, ['bidPriceAvg', 'askPriceAvg']].to_numpy()
+    bars.loc[bars.index % 23 == 0, ['bidVolumeSum', 'askVolumeSum']] = 0.0
+    return bars
+
+@pytest.mark.parametrize('thresholds', [{}, {'spread_threshold': 0.01, 'volume_imbalance_threshold': 0.2}])
+def test_signal_engine_matches_predict_stock(bars, thresholds):
+    expected = analysis.predict_stock(bars, **thresholds)
+
+    engine = analysis.SignalEngine(**thresholds)
+    decisions = [engine.update(bar) for bar in bars.to_dict('records')]
+    assert decisions[0] is None
+    actual = pd.DataFrame(decisions[1:], index=expected.index)
+
+    assert set(expected['decision']) == {'BUY', 'SELL', 'HOLD'}
+    assert (actual['decision'] == expected['decision']).all()
+    assert (actual['timestamp'] == expected['timestamp']).all()
+    for column in ('spread', 'momentum', 'volume_imbalance'):
+        assert np.array_equal(actual[column].to_numpy(dtype=float), expected[column].to_numpy(dtype=float), equal_nan=True), column
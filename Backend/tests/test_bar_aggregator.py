@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+from bar_aggregator import BarAggregator, bars_frame, market_bars, market_ticks
+from conftest import read_market
+
+INTERVALS = (1, 5, 60)
+
+def reference_bars(folder, interval):
+    """
+    The bars of one interval computed in one go with pandas: sums and means per interval,
+    one row for every interval from the first tick to the last.
+    """
+    quotes, trades = read_market(folder)
+    quotes['start'] = quotes['timestamp'].dt.floor(f'{interval}s')
+    trades['start'] = trades['timestamp'].dt.floor(f'{interval}s')
+    starts = pd.date_range(min(quotes['start'].min(), trades['start'].min()),
+                           max(quotes['start'].max(), trades['start'].max()), freq=f'{interval}s')
+
+    quoted = quotes.groupby('start')[['askPrice', 'askVolume', 'bidPrice', 'bidVolume']].agg(['sum', 'mean'])
+    traded = trades.groupby('start')[['price', 'volume']].agg(['sum', 'mean'])
+    traded = traded.rename(columns={'price': 'actualPrice', 'volume': 'actualVolume'})
+    reference = pd.concat([quoted, traded], axis=1, sort=True).reindex(starts)
+    reference.columns = [f"{field}{'Sum' if how == 'sum' else 'Avg'}" for field, how in reference.columns]
+    return reference
+
+def test_bars_match_pandas_for_every_interval(market_folder):
+    bars = list(market_bars(market_folder, INTERVALS))
+
+    for interval in INTERVALS:
+        frame = bars_frame(bars, interval).set_index('timestamp')
+        reference = reference_bars(market_folder, interval)
+        assert list(frame.index) == list(reference.index)  # fill_empty leaves no gap
+
+        traded = reference['actualPriceSum'].notna()
+        for column in ('actualPriceSum', 'actualPriceAvg', 'actualVolumeSum', 'actualVolumeAvg'):
+            np.testing.assert_allclose(frame.loc[traded, column], reference.loc[traded, column], rtol=1e-12)
+            assert (frame.loc[~traded, column] == 0).all()
+
+        quoted = reference['askPriceSum'].notna()
+        for column in ('askPriceSum', 'askPriceAvg', 'bidVolumeSum', 'bidVolumeAvg'):
+            np.testing.assert_allclose(frame.loc[quoted, column], reference.loc[quoted, column], rtol=1e-12)
+
+        # Quoted prices carry over into bars without quotes, after the first quote
+        carried = reference['askPriceAvg'].ffill()
+        gaps = ~quoted & carried.notna()
+        np.testing.assert_array_equal(frame.loc[gaps, 'askPriceAvg'], carried[gaps])
+        assert (frame.loc[gaps, 'askPriceSum'] == 0).all()
+
+def test_bars_of_all_intervals_are_emitted_as_they_close(market_folder):
+    aggregator = BarAggregator(INTERVALS)
+    emitted = {interval: [] for interval in INTERVALS}
+    for kind, tick in market_ticks(market_folder):
+        update = aggregator.update_quote if kind == 'quote' else aggregator.update_trade
+        closed = update(tick)
+
+        # Each batch is in time order, the shorter interval first on equal timestamps
+        keys = [(record['timestamp'], interval) for interval, record in closed]
+        assert keys == sorted(keys)
+        for interval, record in closed:
+            end = record['timestamp'] + pd.Timedelta(seconds=interval)
+            assert end <= tick['timestamp']  # Never before the interval is over
+            emitted[interval].append(record['timestamp'])
+
+        # Every bar whose interval is over has been emitted, so the next one is still open
+        for interval, starts in emitted.items():
+            if starts:
+                assert starts[-1] + pd.Timedelta(seconds=2 * interval) > tick['timestamp']
+
+    for interval in INTERVALS:
+        starts = pd.Series(emitted[interval])
+        assert (starts.diff().dropna() == pd.Timedelta(seconds=interval)).all()
+
+def test_without_fill_empty_only_intervals_with_ticks_have_bars(market_folder):
+    bars = list(market_bars(market_folder, INTERVALS, fill_empty=False))
+
+    for interval in INTERVALS:
+        reference = reference_bars(market_folder, interval)
+        ticked = reference['askPriceSum'].notna() | reference['actualPriceSum'].notna()
+        assert list(bars_frame(bars, interval)['timestamp']) == list(reference.index[ticked])
+
+def quote(timestamp, price):
+    return {'timestamp': pd.Timestamp(timestamp), 'askPrice': price, 'askVolume': 1.0, 'bidPrice': price, 'bidVolume': 1.0}
+
+def trade(timestamp, price):
+    return {'timestamp': pd.Timestamp(timestamp), 'price': price, 'volume': 1.0}
+
+def feed(aggregator, ticks):
+    closed = []
+    for tick in ticks:
+        update = aggregator.update_trade if 'price' in tick else aggregator.update_quote
+        closed.extend(update(tick))
+    return closed + aggregator.flush()
+
+def test_ticks_within_allowed_lateness_join_their_bar():
+    ticks = [trade('2025-01-01 09:00:00.5', 10.0), trade('2025-01-01 09:00:01.2', 11.0),
+             trade('2025-01-01 09:00:00.9', 12.0), trade('2025-01-01 09:00:02.1', 13.0)]
+
+    # A second of lateness keeps the first bar open until a tick past 09:00:02
+    aggregator = BarAggregator((1,), allowed_lateness=1.0)
+    bars = feed(aggregator, ticks)
+    assert [record['actualPriceSum'] for _, record in bars] == [22.0, 11.0, 13.0]
+    assert aggregator.late_ticks == 0
+
+    # Without lateness the first bar closed at 09:00:01.2 and the tick at 09:00:00.9 is dropped
+    aggregator = BarAggregator((1,))
+    bars = feed(aggregator, ticks)
+    assert [record['actualPriceSum'] for _, record in bars] == [10.0, 11.0, 13.0]
+    assert aggregator.late_ticks == 1
+
+def test_late_tick_is_counted_once_across_intervals():
+    aggregator = BarAggregator((1, 5))
+    feed(aggregator, [quote('2025-01-01 09:00:00', 10.0), quote('2025-01-01 09:00:06', 11.0),
+                      quote('2025-01-01 09:00:02', 12.0)])
+    assert aggregator.late_ticks == 1
+
+@pytest.mark.parametrize('fill_empty, expected', [(True, 4), (False, 2)])
+def test_gap_between_ticks(fill_empty, expected):
+    aggregator = BarAggregator((1,), fill_empty=fill_empty)
+    bars = feed(aggregator, [quote('2025-01-01 09:00:00', 10.0), trade('2025-01-01 09:00:03', 11.0)])
+
+    assert len(bars) == expected
+    if fill_empty:
+        # The empty seconds repeat the last quoted prices with zero sums
+        assert [record['askPriceAvg'] for _, record in bars] == [10.0] * 4
+        assert [record['askPriceSum'] for _, record in bars] == [10.0, 0.0, 0.0, 0.0]
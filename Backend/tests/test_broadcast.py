@@ -0,0 +1,58 @@
+import pytest
+from broadcast import Subscriber
+
+def queued(subscriber):
+    items = []
+    while subscriber.qsize():
+        items.append(subscriber.get(timeout=0))
+    return items
+
+def test_drop_oldest_keeps_the_newest_messages():
+    subscriber = Subscriber(subscription=None, queue_size=3, overflow='drop_oldest')
+    for tick in range(5):
+        subscriber.put('A', tick)
+
+    assert queued(subscriber) == [('A', 2), ('A', 3), ('A', 4)]
+    assert subscriber.dropped == 2
+
+def test_coalesce_keeps_the_latest_message_per_market_in_place():
+    subscriber = Subscriber(subscription=None, queue_size=3, overflow='coalesce')
+    for market, tick in [('A', 1), ('B', 1), ('A', 2), ('C', 1), ('A', 3), ('B', 2)]:
+        subscriber.put(market, tick)
+
+    # Each market keeps its place in the queue, holding its latest tick
+    assert queued(subscriber) == [('A', 3), ('B', 2), ('C', 1)]
+    assert subscriber.dropped == 3
+
+def test_coalesce_drops_the_oldest_once_every_market_is_pending():
+    subscriber = Subscriber(subscription=None, queue_size=2, overflow='coalesce')
+    for market in ['A', 'B', 'C']:
+        subscriber.put(market, 1)
+
+    assert queued(subscriber) == [('B', 1), ('C', 1)]
+    assert subscriber.dropped == 1
+
+def test_coalesce_never_merges_errors_or_the_end_marker():
+    subscriber = Subscriber(subscription=None, queue_size=5, overflow='coalesce')
+    error = {"status": "error", "message": "boom"}
+    subscriber.put(None, error)
+    subscriber.put(None, error)
+    subscriber.finish()
+    subscriber.put('A', 1)
+
+    assert queued(subscriber) == [(None, error), (None, error), (None, None), ('A', 1)]
+    assert subscriber.dropped == 0
+
+def test_disconnect_closes_the_subscriber_that_falls_behind():
+    subscriber = Subscriber(subscription=None, queue_size=2, overflow='disconnect')
+    for tick in range(3):
+        subscriber.put('A', tick)
+
+    assert subscriber.disconnected
+    assert subscriber.get(timeout=0) is None
+    subscriber.put('A', 4)
+    assert subscriber.qsize() == 2  # Nothing is queued after the disconnect
+
+def test_unknown_overflow_policy_is_rejected():
+    with pytest.raises(ValueError):
+        Subscriber(subscription=None, overflow='block')
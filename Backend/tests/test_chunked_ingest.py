@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+import features
+from data_processing import training_matrix
+from chunked_ingest import iter_featurized_blocks, load_market
+from conftest import assert_frames_identical
+
+# Chunks of 16 rows split the fixture's run of 21 trades on one timestamp, so that second
+# spans several blocks; the largest size reads the market in one block
+@pytest.mark.parametrize('chunksize', [16, 100, 1_000_000])
+def test_featurized_blocks_match_in_memory(market_folder, chunksize):
+    expected = features.featurize(load_market(market_folder, float_dtype="float64"))
+
+    blocks = list(iter_featurized_blocks(market_folder, chunksize=chunksize))
+    actual = pd.concat(blocks, ignore_index=True)
+    assert_frames_identical(expected, actual)
+
+def test_rolling_mean_in_blocks_matches_whole_series():
+    rng = np.random.default_rng(3)
+    prices = np.round(100 + np.cumsum(rng.normal(0, 0.05, 2000)), 2)
+    prices[rng.integers(0, len(prices), 50)] = np.nan
+    prices[500:530] = 100.01
+
+    expected = features.rolling_mean(prices)
+    for size in (1, 7, 64):
+        blocks = [features.rolling_mean(prices[start:start + size], history=prices[:start])
+                  for start in range(0, len(prices), size)]
+        assert np.array_equal(np.concatenate(blocks), expected, equal_nan=True)
+
+    np.testing.assert_allclose(expected, pd.Series(prices).rolling(features.SMOOTHING_WINDOW, min_periods=1).mean(), rtol=1e-14)
+    assert (expected[509:530] == 100.01).all()  # A flat run smooths to its own price
+
+def test_chunked_training_matrix_matches_in_memory(market_folder):
+    assert_frames_identical(training_matrix(market_folder), training_matrix(market_folder, chunksize=16))
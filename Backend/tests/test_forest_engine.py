@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+import features
+from chunked_ingest import load_market
+from forest_engine import CompiledForest, export_forest
+
+@pytest.fixture
+def training_frame(market_folder):
+    merged_df = features.featurize(load_market(market_folder))
+    return merged_df[features.FEATURE_COLUMNS], np.asarray(merged_df['label']).astype(str)
+
+@pytest.fixture
+def forests(training_frame, tmp_path):
+    X, y = training_frame
+    model = RandomForestClassifier(n_estimators=15, max_depth=8, random_state=0).fit(X, y)
+    export_forest(model, str(tmp_path / "compiled_forest"), features.feature_schema())
+    return model, CompiledForest(str(tmp_path / "compiled_forest"))
+
+def edge_rows(model, X):
+    """
+    Rows placed exactly on, and just above, split thresholds of the model, where a float32
+    or comparison mismatch would send a row down the other branch.
+    """
+    rows = []
+    for estimator in model.estimators_[:5]:
+        tree = estimator.tree_
+        for node in np.flatnonzero(tree.feature >= 0):
+            row = np.array(X.iloc[len(rows) % len(X)], dtype=float)
+            row[tree.feature[node]] = tree.threshold[node]
+            rows.append(row)
+            row = row.copy()
+            row[tree.feature[node]] = np.nextafter(np.float32(tree.threshold[node]), np.float32(np.inf))
+            rows.append(row)
+    return pd.DataFrame(rows, columns=X.columns)
+
+def test_compiled_forest_matches_sklearn(training_frame, forests):
+    X, _ = training_frame
+    model, compiled = forests
+
+    # NaN momentum and quotes are present in the training rows themselves
+    assert X.isna().any().any()
+    for rows in (X, edge_rows(model, X)):
+        assert (compiled.predict(rows) == model.predict(rows)).all()
+        np.testing.assert_allclose(compiled.predict_proba(rows), model.predict_proba(rows), rtol=0, atol=1e-12)
+
+def test_compiled_forest_header(forests):
+    model, compiled = forests
+    assert list(compiled.classes_) == list(model.classes_)
+    assert compiled.feature_schema == features.feature_schema()
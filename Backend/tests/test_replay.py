@@ -0,0 +1,36 @@
+from replay import merge_subscribed_markets
+
+MARKETS = {'A': [1, 2, 3], 'B': [2, 4, 5]}
+
+def open_market(market):
+    return ({'timestamp': timestamp, 'market': market} for timestamp in MARKETS[market])
+
+def streamed(events):
+    return [(timestamp, market) for timestamp, market, row in events]
+
+def test_switching_markets_keeps_the_stream_open():
+    # A subscriber watches A, leaves it after two events, then picks B after a few idle polls;
+    # B joins at the last streamed time
+    wanted = [{'A'}, {'A'}, set(), set(), set(), {'B'}]
+    polls = []
+
+    def wanted_markets():
+        return wanted.pop(0) if len(wanted) > 1 else wanted[0]
+
+    events = list(merge_subscribed_markets(open_market, wanted_markets, sleep=polls.append))
+
+    assert streamed(events) == [(1, 'A'), (2, 'A'), (2, 'B'), (4, 'B'), (5, 'B')]
+    assert polls  # The merge waited for B rather than ending
+
+def test_stream_ends_when_nobody_is_subscribed():
+    wanted = [{'A'}, None]
+
+    def wanted_markets():
+        return wanted.pop(0)
+
+    events = list(merge_subscribed_markets(open_market, wanted_markets, sleep=lambda _: None))
+    assert streamed(events) == [(1, 'A')]
+
+def test_stream_ends_once_wanted_markets_are_exhausted():
+    events = list(merge_subscribed_markets(open_market, lambda: {'A', 'B'}, sleep=lambda _: None))
+    assert streamed(events) == [(1, 'A'), (2, 'B'), (2, 'A'), (3, 'A'), (4, 'B'), (5, 'B')]
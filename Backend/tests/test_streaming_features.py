@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import features
+import streaming_features
+from conftest import read_market, assert_frames_identical
+
+def batch_features(quotes, trades):
+    merged_df = pd.merge_asof(trades, quotes, on='timestamp', direction='backward')
+    return features.featurize(merged_df)
+
+def test_replay_matches_batch_features(market_folder):
+    quotes, trades = read_market(market_folder)
+    expected = batch_features(quotes, trades)
+
+    actual = pd.DataFrame(list(streaming_features.replay(quotes, trades)))[expected.columns]
+    assert_frames_identical(expected, actual)
+
+def test_edge_cases_are_covered(market_folder):
+    quotes, trades = read_market(market_folder)
+    expected = batch_features(quotes, trades)
+
+    assert expected['momentum'].isna().any()
+    assert expected['bidPrice'].isna().any()
+    assert expected['timestamp'].duplicated().any()
+    assert trades['timestamp'].isin(quotes['timestamp']).any()
+
+def test_repeated_prices_and_tiny_values():
+    timestamps = pd.to_datetime(["10:00:00.000000"] * 3 + ["10:00:00.500000"] * 20 + ["10:00:01.250000"] * 5, format="%H:%M:%S.%f")
+    prices = np.r_[[1e-9, 1e9, 1e-9], np.full(20, 100.01), np.linspace(99.99, 100.03, 5)]
+    trades = pd.DataFrame({'price': prices, 'volume': np.arange(len(prices), dtype=float), 'timestamp': timestamps})
+    quotes = pd.DataFrame({'bidVolume': [5.0], 'bidPrice': [100.0], 'askVolume': [3.0], 'askPrice': [100.02],
+                           'timestamp': pd.to_datetime(["10:00:00.000000"], format="%H:%M:%S.%f")})
+
+    expected = batch_features(quotes, trades)
+    actual = pd.DataFrame(list(streaming_features.replay(quotes, trades)))[expected.columns]
+    assert_frames_identical(expected, actual)
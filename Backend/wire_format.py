@@ -0,0 +1,108 @@
+import json
+import math
+import numpy as np
+import pandas as pd
+
+# Wire formats a client can ask for; plain per-row JSON stays the default
+WIRE_FORMATS = ('rows', 'columnar')
+DEFAULT_WIRE_FORMAT = 'rows'
+
+# Maximum number of rows of one market packed in a columnar message
+DEFAULT_BATCH_SIZE = 100
+
+# Quoted prices that can be sent as integer tick deltas
+DELTA_FIELDS = ('price', 'bidPrice', 'askPrice')
+PRICE_TICK = 0.01
+
+def to_json_value(value):
+    """
+    Convert a pandas/numpy value to something json can encode; missing values become null.
+    """
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, (np.integer, np.bool_)):
+        return value.item()
+    if isinstance(value, (float, np.floating)):
+        return None if math.isnan(value) else float(value)
+    return value
+
+def epoch_millis(value):
+    if value is None or value is pd.NaT:
+        return None
+    return pd.Timestamp(value).value // 1_000_000
+
+def encode_message(message):
+    return json.dumps({key: to_json_value(value) for key, value in message.items()})
+
+def encode_row(row, fields=None):
+    """
+    Plain per-row JSON, restricted to the requested fields.
+    """
+    if fields is not None:
+        row = {field: row.get(field) for field in fields}
+    return encode_message(row)
+
+def delta_encode(values, tick=PRICE_TICK):
+    """
+    Encode prices as integer tick counts: the first value absolute, then differences.
+    Returns None when a value is missing or not on the tick grid, so the field is sent as is.
+    """
+    ticks = []
+    for value in values:
+        if value is None:
+            return None
+        count = round(value / tick)
+        if abs(count * tick - value) > 1e-9:
+            return None
+        ticks.append(count)
+    return ticks[:1] + [current - previous for previous, current in zip(ticks, ticks[1:])]
+
+def encode_batch(market, rows, fields=None, delta=False):
+    """
+    Columnar micro-batch of one market's rows: a field list plus one array per field.
+    Timestamps are epoch milliseconds, and with delta the quoted prices are tick deltas.
+    """
+    if fields is None:
+        fields = list(rows[0])
+
+    columns = []
+    delta_fields = []
+    for field in fields:
+        if field == 'timestamp':
+            columns.append([epoch_millis(row.get(field)) for row in rows])
+            continue
+
+        values = [to_json_value(row.get(field)) for row in rows]
+        if delta and field in DELTA_FIELDS:
+            encoded = delta_encode(values)
+            if encoded is not None:
+                values = encoded
+                delta_fields.append(field)
+        columns.append(values)
+
+    batch = {"type": "batch", "market": market, "count": len(rows), "fields": fields, "columns": columns}
+    if delta_fields:
+        batch["delta"] = delta_fields
+        batch["tick"] = PRICE_TICK
+    return json.dumps(batch)
+
+def frame_columns(frame, fields=None):
+    """
+    Columns of a whole frame as JSON-ready lists, converted column by column: timestamps as
+    epoch milliseconds and missing values as null.
+    """
+    if fields is None:
+        fields = [str(column) for column in frame.columns]
+
+    columns = []
+    for field in fields:
+        values = frame[field].to_numpy()
+        if field == 'timestamp':
+            columns.append((values.astype('datetime64[ns]').view(np.int64) // 1_000_000).tolist())
+        elif values.dtype.kind == 'f':
+            columns.append(np.where(np.isnan(values), None, values.astype(object)).tolist())
+        else:
+            columns.append([to_json_value(value) for value in values.tolist()])
+    return fields, columns
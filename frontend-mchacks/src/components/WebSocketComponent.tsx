@@ -4,6 +4,31 @@ interface WebSocketComponentProps {
   updateData: (data: any) => void; // Function to pass parsed WebSocket data
 }
 
+// Expand a columnar batch or history response ({ fields, columns }) back into one object per row
+export const expandBatch = (batch: any): any[] => {
+  const columns: any[][] = batch.columns.map((column: any[], index: number) => {
+    if (!(batch.delta ?? []).includes(batch.fields[index])) {
+      return column;
+    }
+    // Delta fields hold integer tick counts: the first value absolute, then differences
+    let ticks = 0;
+    return column.map((delta: number) => {
+      ticks += delta;
+      return Number((ticks * batch.tick).toFixed(10));
+    });
+  });
+
+  const rows = [];
+  for (let row = 0; row < batch.count; row++) {
+    const entry: any = { market: batch.market };
+    batch.fields.forEach((field: string, index: number) => {
+      entry[field] = columns[index][row];
+    });
+    rows.push(entry);
+  }
+  return rows;
+};
+
 const WebSocketComponent: React.FC<WebSocketComponentProps> = ({ updateData }) => {
   useEffect(() => {
     const ws = new WebSocket("ws://127.0.0.1:5000/stream");
@@ -15,7 +40,11 @@ const WebSocketComponent: React.FC<WebSocketComponentProps> = ({ updateData }) =
     ws.onmessage = (event: MessageEvent) => {
       try {
         const parsedData = JSON.parse(event.data);
-        updateData(parsedData);
+        if (parsedData.type === "batch") {
+          expandBatch(parsedData).forEach(updateData);
+        } else {
+          updateData(parsedData);
+        }
       } catch (error) {
         console.error("Failed to parse message data: ", error);
       }
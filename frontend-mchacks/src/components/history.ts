@@ -0,0 +1,21 @@
+import { expandBatch } from "./WebSocketComponent";
+
+// Load a window of past ticks or bars of a market; the server bounds the number of points
+export const fetchHistory = async (
+  market: string,
+  from?: string,
+  to?: string,
+  resolution: string = "auto",
+  maxPoints: number = 1000
+): Promise<any[]> => {
+  const params = new URLSearchParams({ market, resolution, max_points: String(maxPoints) });
+  if (from) params.set("from", from);
+  if (to) params.set("to", to);
+
+  const response = await fetch(`http://127.0.0.1:5000/history?${params}`);
+  const data = await response.json();
+  if (data.status === "error") {
+    throw new Error(data.message);
+  }
+  return expandBatch(data);
+};